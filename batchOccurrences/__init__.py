@@ -1,51 +1,34 @@
 import logging
 import os
 import azure.functions as func
-import pyodbc
 import requests
 import time
 from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 import json
-import base64
-
-db_url = os.environ["DB_URL"]
-db = os.environ["DB"]
-db_username = os.environ["DB_USERNAME"]
-db_password = os.environ["DB_PASSWORD"]
-db_driver = os.environ["DB_DRIVER"]
-jc_api_url = os.environ["JC_API_URL"]
-jc_api_username = os.environ["JC_API_USERNAME"]
-jc_api_login_path = os.environ["JC_API_LOGIN_PATH"]
-jc_api_upsert_path = os.environ["JC_API_UPSERT_PATH"]
+
+from shared_code import database, images, jc
+
 default_image_url = os.environ["DEFAULT_IMAGE_URL"]
-base64_image_cache = {}
+# number of image downloads kept in flight at once
+image_concurrency = int(os.environ.get("IMAGE_CONCURRENCY", "8"))
+# occurrences read from the database and given their images at a time
+read_chunk_size = int(os.environ.get("READ_CHUNK_SIZE", "100"))
+# upsert batches are packed up to a byte budget that adapts to how JC copes with them,
+# it shrinks on 413 responses, timeouts and slow requests and grows back on fast ones
+jc_batch_max_bytes = int(os.environ.get("JC_BATCH_MAX_BYTES", str(4 * 1024 * 1024)))
+jc_batch_min_bytes = int(os.environ.get("JC_BATCH_MIN_BYTES", str(256 * 1024)))
+jc_batch_max_items = int(os.environ.get("JC_BATCH_MAX_ITEMS", "25"))
+jc_batch_target_seconds = float(os.environ.get("JC_BATCH_TARGET_SECONDS", "10"))
+jc_upsert_timeout = float(os.environ.get("JC_UPSERT_TIMEOUT", "120"))
+# kept across warm invocations so each run starts from what the previous one learnt
+jc_batch_budget = {"bytes": jc_batch_max_bytes}
 
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("Call batchOccurences function.")
 
-    # DB retry
-    cnxn = None
-    for i in range(0, 4):
-        while True:
-            try:
-                cnxn = pyodbc.connect(
-                    "DRIVER="
-                    + db_driver
-                    + ";SERVER="
-                    + db_url
-                    + ";PORT=1433;DATABASE="
-                    + db
-                    + ";UID="
-                    + db_username
-                    + ";PWD="
-                    + db_password
-                    + ";Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
-                )
-            except pyodbc.Error as ex:
-                time.sleep(2.0)
-                continue
-            break
+    cnxn = database.getConnection()
     if cnxn == None:
         logging.info("Could not connect to database")
         return func.HttpResponse("Could not obtain accessToken", status_code=400)
@@ -54,53 +37,207 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
     start_time = time.time()
 
-    rows = cursor.execute(f"SELECT json FROM occurrences WHERE send=1").fetchall()
-    list_of_json_dict = [json.loads(row.json) for row in rows]
-
-    jc_batch_size = 10
-    total_record_count = len(rows)
+    total_record_count = 0
     batches_sent = 0
     success_count = 0
     error_count = 0
 
-    logging.info(f"Received {total_record_count} results to send")
-
-    # need to add back the b64 images
-    new_list = []
-    for dict in list_of_json_dict:
-        b64 = ""
-        try:
-            b64 = getBase64String(dict["appImage"])  # these are always square? 350x350
-        except:
-            b64 = getBase64String(default_image_url)
-
-        dict["appImage"] = b64  # Base64 image string 4:3
-        dict["webImage"] = b64  # supposed to be 16:9
-        new_list.append(dict)
+    pending_count = cursor.execute(
+        "SELECT COUNT(*) AS pending FROM occurrences WHERE send=1"
+    ).fetchone()
+    logging.info(f"Received {pending_count.pending} results to send")
 
-    accessToken = getAccessToken()
-    if accessToken is None:
+    if jc.getAccessToken() is None:
         logging.info("Could not obtain accessToken.")
         cursor.close()
-        cnxn.close()
+        database.releaseConnection(cnxn)
         return func.HttpResponse("Could not obtain accessToken", status_code=400)
 
-    for batch in batched(new_list, jc_batch_size):
-        # send batch
-        successes, errors = upsertVOs(accessToken, batch, cnxn, cursor)
-        success_count += successes
-        error_count += errors
-        batches_sent += 1
+    # the backlog is read, given its images and sent one chunk at a time so only one chunk is in memory
+    image_stats = images.newStats()
+    timed_out = False
+    with ThreadPoolExecutor(max_workers=image_concurrency) as executor:
+        try:
+            for chunk in batched(
+                iterPendingOccurrences(cursor, read_chunk_size), read_chunk_size
+            ):
+                successes, errors, batches = sendChunk(
+                    chunk, executor, image_stats, cnxn, cursor
+                )
+                total_record_count += len(chunk)
+                success_count += successes
+                error_count += errors
+                batches_sent += batches
+        except requests.ReadTimeout:
+            # JC is too slow to keep sending within the function timeout, the rest stays send=1 for the next run
+            logging.error(
+                f"JC did not answer an upsert within {jc_upsert_timeout}s, stopped sending"
+            )
+            timed_out = True
+
+    evicted_images = images.evictCachedImages(cursor)
+    cnxn.commit()
 
     end_time = time.time()
 
-    return_message = f"Upsert VOs total record(s): {total_record_count}. Sent {success_count} with {error_count} errors, in {batches_sent} batches. Time: {str(end_time-start_time)}s"
+    return_message = f"Upsert VOs total record(s): {total_record_count}{' (stopped on a JC timeout)' if timed_out else ''}. Sent {success_count} with {error_count} errors, in {batches_sent} batches (budget now {jc_batch_budget['bytes']} bytes). Images cached: {image_stats['hits']}, revalidated: {image_stats['revalidated']}, downloaded: {image_stats['misses']}, failed: {image_stats['errors']}, evicted: {evicted_images}. Image bytes sent: {image_stats['sentBytes']} instead of {image_stats['originalBytes']}. Time: {str(end_time-start_time)}s"
     logging.info(return_message)
     cursor.close()
-    cnxn.close()
+    database.releaseConnection(cnxn)
     return func.HttpResponse(return_message, status_code=200)
 
 
+# yields the occurrences waiting to be sent, read chunk_size rows at a time in occurrenceId order
+# each chunk is a separate query so no result set stays open while the upserts update the same rows
+def iterPendingOccurrences(cursor, chunk_size):
+    last_id = ""
+    while True:
+        rows = cursor.execute(
+            "SELECT TOP (?) occurrenceId, json FROM occurrences WHERE send=1 AND occurrenceId > ? ORDER BY occurrenceId",
+            chunk_size,
+            last_id,
+        ).fetchall()
+        if len(rows) == 0:
+            return
+        for row in rows:
+            yield json.loads(row.json)
+        last_id = rows[-1].occurrenceId
+
+
+# adds the images to a chunk of occurrences and upserts it in batches
+# returns (successes, errors, batches sent)
+def sendChunk(chunk, executor, image_stats, cnxn, cursor):
+    success_count = 0
+    error_count = 0
+    batches_sent = 0
+
+    # need to add back the b64 images
+    # distinct urls in order of first use, so the images of the first batches are requested first
+    image_urls = [default_image_url]
+    seen_urls = set(image_urls)
+    for d in chunk:
+        url = d.get("appImage")
+        if url and url not in seen_urls:
+            seen_urls.add(url)
+            image_urls.append(url)
+    cached_images = images.loadCachedImages(cursor, image_urls)
+
+    # every distinct image of the chunk is requested up front, each batch is sent as soon as its own images are ready
+    image_futures = {
+        url: executor.submit(images.getImage, url, cached_images.get(url), image_stats)
+        for url in image_urls
+    }
+    for batch, batch_bytes in packBatches(
+        attachImages(chunk, image_futures, image_stats)
+    ):
+        # send batch
+        successes, errors, batches = sendBatch(batch, batch_bytes, cnxn, cursor)
+        success_count += successes
+        error_count += errors
+        batches_sent += batches
+
+    # later chunks find these images in the cache instead of downloading them again
+    used_images = [
+        future.result()
+        for future in image_futures.values()
+        if future.exception() is None
+    ]
+    image_stats["errors"] += len(image_futures) - len(used_images)
+    images.saveCachedImages(cursor, used_images)
+    cnxn.commit()
+
+    return (success_count, error_count, batches_sent)
+
+
+# yields the occurrences of chunk with their images, waiting for each image only when it is needed
+def attachImages(chunk, image_futures, image_stats):
+    for dict in chunk:
+        image = getImageEntry(dict.get("appImage"), image_futures)
+        if image is None:
+            image = getImageEntry(default_image_url, image_futures)
+
+        dict["appImage"] = image["appB64"]  # Base64 image string 4:3
+        dict["webImage"] = image["webB64"]  # 16:9
+        # previously the source image was sent unchanged as both
+        image_stats["originalBytes"] += 2 * images.base64Length(image["bytes"])
+        image_stats["sentBytes"] += len(image["appB64"]) + len(image["webB64"])
+        yield dict
+
+
+# yields (batch, serialized size) with as many occurrences as fit the current byte budget and item cap
+# a single occurrence larger than the budget is sent on its own
+def packBatches(occurrences):
+    batch = []
+    batch_bytes = 2  # []
+    for dict in occurrences:
+        size = len(json.dumps(dict)) + 1
+        if len(batch) > 0 and (
+            batch_bytes + size > jc_batch_budget["bytes"]
+            or len(batch) >= jc_batch_max_items
+        ):
+            yield (batch, batch_bytes)
+            batch = []
+            batch_bytes = 2
+        batch.append(dict)
+        batch_bytes += size
+    if len(batch) > 0:
+        yield (batch, batch_bytes)
+
+
+# upserts batch, halving it while JC rejects it as too large, and adapts the byte budget to the outcome
+# returns (successes, errors, batches sent)
+# raises requests.ReadTimeout if JC did not answer in time, after shrinking the budget once
+def sendBatch(batch, batch_bytes, cnxn, cursor):
+    start = time.time()
+    try:
+        result = upsertVOs(batch, cnxn, cursor)
+    except requests.ReadTimeout:
+        jc_batch_budget["bytes"] = max(
+            jc_batch_min_bytes, min(jc_batch_budget["bytes"], batch_bytes) // 2
+        )
+        logging.info(
+            f"Batch of {len(batch)} ({batch_bytes} bytes) timed out, budget now {jc_batch_budget['bytes']} bytes"
+        )
+        raise
+    elapsed = time.time() - start
+
+    if result is None:
+        jc_batch_budget["bytes"] = max(
+            jc_batch_min_bytes, min(jc_batch_budget["bytes"], batch_bytes) // 2
+        )
+        logging.info(
+            f"Batch of {len(batch)} ({batch_bytes} bytes) too large, budget now {jc_batch_budget['bytes']} bytes"
+        )
+        if len(batch) == 1:
+            logging.error(
+                f"Could not upsert {batch[0].get('vmpJobId')}, it is too large"
+            )
+            # JC answered 413 even for this occurrence alone, it would be rejected again
+            database.writeOccurrenceStatus(
+                cursor, [(batch[0].get("vmpJobId"), "ERRORED", "Too large for JC")]
+            )
+            cnxn.commit()
+            return (0, 1, 1)
+
+        half = len(batch) // 2
+        first = sendBatch(batch[:half], batch_bytes // 2, cnxn, cursor)
+        second = sendBatch(batch[half:], batch_bytes // 2, cnxn, cursor)
+        return (first[0] + second[0], first[1] + second[1], 1 + first[2] + second[2])
+
+    if elapsed > jc_batch_target_seconds:
+        jc_batch_budget["bytes"] = max(
+            jc_batch_min_bytes, int(jc_batch_budget["bytes"] * 0.75)
+        )
+    elif batch_bytes >= jc_batch_budget["bytes"] * 0.5:
+        # only grow when the budget was actually used, small tail batches say nothing about it
+        jc_batch_budget["bytes"] = min(
+            jc_batch_max_bytes, int(jc_batch_budget["bytes"] * 1.25)
+        )
+
+    successes, errors = result
+    return (successes, errors, 1)
+
+
 def batched(iterable, n):
     # "Batch data into lists of length n. The last batch may be shorter."
     # batched('ABCDEFG', 3) --> ABC DEF G
@@ -111,53 +248,42 @@ def batched(iterable, n):
         yield batch
 
 
-def getAccessToken():
-    retries = 1
-    while retries < 3:
-        r = requests.post(
-            f"https://{jc_api_url}/{jc_api_login_path}", json={"email": jc_api_username}
-        )
-        # logging.info(r)
-        if r.status_code == 200:
-            return r.json().get("accessToken")
-        else:
-            wait = retries * 3
-            time.sleep(wait)
-            retries += 1
-
-    return None
-
-
-def upsertVOs(accessToken, list, cnxn, cursor):
+# returns (successes, errors), or None if JC rejected the batch as too large
+# raises requests.ReadTimeout if JC did not answer in time, the upsert may still have been applied
+def upsertVOs(list, cnxn, cursor):
     retries = 1
-    head = {"Authorization": "Bearer " + accessToken}
 
     while retries < 3:
-        r = requests.post(
-            f"https://{jc_api_url}/{jc_api_upsert_path}", json=list, headers=head
-        )
+        try:
+            r = jc.upsert(list, timeout=jc_upsert_timeout)
+        except requests.ReadTimeout:
+            raise
+        except requests.RequestException as err:
+            logging.info(f"Could not send upsert: {err}")
+            r = None
+        if r is None:
+            break
+        if r.status_code == 413:
+            return None
         if r.status_code == 200:
             dict = r.json()
             logging.info(dict)
             errors = dict.get("error")
             successes = dict.get("success")
 
+            # all results of the batch are written back together
+            results = []
             if successes.get("total") > 0:
-                ids = successes.get("ids")
-                sql_ids = (",").join(f"'{w}'" for w in ids)
-                cursor.execute(
-                    f"UPDATE occurrences SET send=0, status='SENT', error='', updatedAt='{time.strftime('%Y-%m-%d %H:%M:%S')}' WHERE occurrenceId IN ({sql_ids})"
-                )
-                cnxn.commit()
+                results.extend((id, "SENT", "") for id in successes.get("ids"))
 
             if errors.get("total") > 0:
-                for d in errors.get("data"):
-                    id = d.get("id")
-                    message = d.get("message")
-                    cursor.execute(
-                        f"UPDATE occurrences SET send=0, status='ERRORED', error='{message}', updatedAt='{time.strftime('%Y-%m-%d %H:%M:%S')}' WHERE occurrenceId='{id}'"
-                    )
-                    cnxn.commit()
+                results.extend(
+                    (d.get("id"), "ERRORED", d.get("message"))
+                    for d in errors.get("data")
+                )
+
+            database.writeOccurrenceStatus(cursor, results)
+            cnxn.commit()
 
             return (successes.get("total"), errors.get("total"))
         else:
@@ -177,10 +303,12 @@ def upsertVOs(accessToken, list, cnxn, cursor):
     return (0, len(list))
 
 
-def getBase64String(url):
-    if url in base64_image_cache:
-        return base64_image_cache[url]
-
-    b64 = base64.b64encode(requests.get(url).content).decode("utf-8")
-    base64_image_cache[url] = b64
-    return b64
+# returns the image entry of url from its prefetch future, None if it could not be fetched
+def getImageEntry(url, image_futures):
+    if url not in image_futures:
+        return None
+    try:
+        return image_futures[url].result()
+    except Exception as err:
+        logging.info(f"Could not get image {url}: {err}")
+        return None
@@ -0,0 +1,114 @@
+import logging
+import os
+import time
+import requests
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+import azure.functions as func
+
+from shared_code import database, jc
+
+# number of JC link calls kept in flight at once
+link_concurrency = int(os.environ.get("LINK_CONCURRENCY", "8"))
+# volunteers linked and written back per commit
+link_batch_size = int(os.environ.get("LINK_BATCH_SIZE", "100"))
+
+
+# Links the volunteers of registrations collected by collectRegistrations that are still NOT_SENT
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info("Call batchRegistrations function.")
+
+    cnxn = database.getConnection()
+    if cnxn == None:
+        logging.info("Could not connect to database")
+        return func.HttpResponse("Could not obtain accessToken", status_code=400)
+
+    cursor = cnxn.cursor()
+
+    start_time = time.time()
+    linked_count = 0
+    error_count = 0
+    retry_count = 0
+
+    user_ids = [
+        row.jcvarId
+        for row in cursor.execute(
+            "SELECT DISTINCT jcvarId FROM registrations WHERE status='NOT_SENT'"
+        ).fetchall()
+    ]
+    if len(user_ids) == 0:
+        cursor.close()
+        database.releaseConnection(cnxn)
+        return func.HttpResponse("No Registrations to link", status_code=200)
+
+    if jc.getAccessToken() is None:
+        logging.info("Could not obtain accessToken.")
+        cursor.close()
+        database.releaseConnection(cnxn)
+        return func.HttpResponse("Could not obtain accessToken", status_code=400)
+
+    with ThreadPoolExecutor(max_workers=link_concurrency) as executor:
+        for batch in batched(user_ids, link_batch_size):
+            results = []
+            for result in executor.map(linkUser, batch):
+                if result is None:
+                    # left NOT_SENT for the next run
+                    retry_count += 1
+                    continue
+                results.append(result)
+                if result[1] == "LINKED":
+                    linked_count += 1
+                else:
+                    error_count += 1
+
+            database.writeRegistrationStatus(cursor, results)
+            cnxn.commit()
+
+    end_time = time.time()
+
+    return_message = f"Registrations total volunteer(s): {len(user_ids)}. Linked {linked_count} with {error_count} errors, {retry_count} left for the next run. Time: {str(end_time-start_time)}s"
+    logging.info(return_message)
+    cursor.close()
+    database.releaseConnection(cnxn)
+    return func.HttpResponse(return_message, status_code=200)
+
+
+def batched(iterable, n):
+    "Batch data into lists of length n. The last batch may be shorter."
+    # batched('ABCDEFG', 3) --> ABC DEF G
+    if n < 1:
+        raise ValueError("n must be at least one")
+    it = iter(iterable)
+    while batch := list(islice(it, n)):
+        yield batch
+
+
+# Runs on the executor threads and does not touch the database.
+# returns (userId, status, error), or None if JC could not be reached and the link should be tried again later
+def linkUser(userId):
+    retries = 1
+    while retries < 3:
+        try:
+            r = jc.link(userId, True)
+        except requests.RequestException as err:
+            logging.info(f"Could not link {userId}: {err}")
+            return None
+        if r is None:
+            break
+        if r.status_code == 200:
+            dict = r.json()
+            logging.info(dict)
+
+            if "isLink" in dict:
+                return (userId, "LINKED", None)
+            return (userId, "ERRORED", dict.get("message"))
+        elif r.status_code == 404:
+            # Var user ID not found
+            logging.info(f"Var user ID: {userId} not found")
+            return (userId, "ERRORED", f"Var user ID: {userId} not found")
+        else:
+            logging.info(r.content)
+            wait = retries * 3
+            time.sleep(wait)
+            retries += 1
+    return None
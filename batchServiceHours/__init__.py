@@ -1,48 +1,15 @@
 import logging
-import os
-import pyodbc
 import time
-import requests
 from itertools import islice
 import azure.functions as func
 
-db_url = os.environ["DB_URL"]
-db = os.environ["DB"]
-db_username = os.environ["DB_USERNAME"]
-db_password = os.environ["DB_PASSWORD"]
-db_driver = os.environ["DB_DRIVER"]
-jc_api_url = os.environ["JC_API_URL"]
-jc_api_username = os.environ["JC_API_USERNAME"]
-jc_api_login_path = os.environ["JC_API_LOGIN_PATH"]
-jc_api_volunteer_linkage_path = os.environ["JC_API_VOLUNTEER_LINKAGE_PATH"]
-jc_api_hours_path = os.environ["JC_API_HOURS_PATH"]
+from shared_code import database, jc
 
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("Python HTTP trigger function processed a request.")
 
-    # DB retry
-    cnxn = None
-    for i in range(0, 4):
-        while True:
-            try:
-                cnxn = pyodbc.connect(
-                    "DRIVER="
-                    + db_driver
-                    + ";SERVER="
-                    + db_url
-                    + ";PORT=1433;DATABASE="
-                    + db
-                    + ";UID="
-                    + db_username
-                    + ";PWD="
-                    + db_password
-                    + ";Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
-                )
-            except pyodbc.Error as ex:
-                time.sleep(2.0)
-                continue
-            break
+    cnxn = database.getConnection()
     if cnxn == None:
         logging.info("Could not connect to database")
         return func.HttpResponse("Could not obtain accessToken", status_code=400)
@@ -56,15 +23,18 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     success_count = 0
     error_count = 0
 
-    accessToken = getAccessToken()
-    if accessToken is None:
+    if jc.getAccessToken() is None:
         cursor.close()
-        cnxn.close()
+        database.releaseConnection(cnxn)
         return func.HttpResponse("Could not obtain accessToken", status_code=400)
 
-    l = []
+    # each volunteer-occurrence pair is sent once with its latest hours, even if duplicates from
+    # before the natural key or several LINKED registrations of the volunteer exist
+    latest = {}
+    # the stored values of each pair that is sent, its status is only written back while they are unchanged
+    sent_rows = {}
     rows = cursor.execute(
-        f"SELECT occurrenceId, volunteerId, startDate, endDate, hours FROM serviceHours s, registrations r WHERE s.status='NOT_SENT' AND r.status='LINKED' and jcvarId=volunteerId"
+        "SELECT occurrenceId, volunteerId, startDate, endDate, hours FROM serviceHours s WHERE s.status='NOT_SENT' AND EXISTS (SELECT 1 FROM registrations r WHERE r.jcvarId = s.volunteerId AND r.status='LINKED') ORDER BY s.createdAt"
     ).fetchall()
     for row in rows:
         dict = {
@@ -74,18 +44,21 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             "endDateTime": (row.endDate.isoformat() + ".000Z"),
             "hour": float(row.hours),
         }
-        # linked = isUserLinked(accessToken, row.volunteerId)
+        # linked = isUserLinked(row.volunteerId)
         # if linked:
-        l.append(dict)
+        latest[(row.occurrenceId, row.volunteerId)] = dict
+        sent_rows[(row.occurrenceId, row.volunteerId)] = row
+    l = list(latest.values())
+    total_record_count = len(l)
 
     if len(l) == 0:
         cursor.close()
-        cnxn.close()
+        database.releaseConnection(cnxn)
         return func.HttpResponse("No Service Hours to send", status_code=200)
 
     for batch in batched(l, jc_batch_size):
         # send batch
-        successes, errors = sendHours(accessToken, batch, cnxn, cursor)
+        successes, errors = sendHours(batch, sent_rows, cnxn, cursor)
         success_count += successes
         error_count += errors
         batches_sent += 1
@@ -95,7 +68,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     return_message = f"Service Hours total record(s): {total_record_count}. Sent {success_count} with {error_count} errors, in {batches_sent} batches. Time: {str(end_time-start_time)}s"
     logging.info(return_message)
     cursor.close()
-    cnxn.close()
+    database.releaseConnection(cnxn)
     return func.HttpResponse(return_message, status_code=200)
 
 
@@ -109,54 +82,37 @@ def batched(iterable, n):
         yield batch
 
 
-def getAccessToken():
-    retries = 1
-    while retries < 3:
-        r = requests.post(
-            f"https://{jc_api_url}/{jc_api_login_path}", json={"email": jc_api_username}
-        )
-        if r.status_code == 200:
-            return r.json().get("accessToken")
-        else:
-            wait = retries * 3
-            time.sleep(wait)
-            retries += 1
-
-    return None
-
-
-def sendHours(accessToken, list, cnxn, cursor):
+# sent_rows maps (occurrenceId, volunteerId) to the serviceHours row the entry of list was made from
+def sendHours(list, sent_rows, cnxn, cursor):
     # logging.info(list)
     retries = 1
-    head = {"Authorization": "Bearer " + accessToken}
     while retries < 3:
-        r = requests.post(
-            f"https://{jc_api_url}/{jc_api_hours_path}", json=list, headers=head
-        )
+        r = jc.hours(list)
+        if r is None:
+            break
         if r.status_code == 200:
             dict = r.json()
             logging.info(dict)
             errors = dict.get("error")
             successes = dict.get("success")
 
+            # all results of the batch are written back together, against the values that were sent
+            results = []
             if successes.get("total") > 0:
-                for d in successes.get("ids"):
-                    varUserId = d.get("varUserId")
-                    vmpJobId = d.get("vmpJobId")
-                    cursor.execute(
-                        f"UPDATE serviceHours SET status='SENT', updatedAt='{time.strftime('%Y-%m-%d %H:%M:%S')}' WHERE occurrenceId='{vmpJobId}' AND volunteerId='{varUserId}'"
-                    )
-                    cnxn.commit()
+                results.extend(
+                    sentResult(sent_rows, d, "SENT", None) for d in successes.get("ids")
+                )
 
             if errors.get("total") > 0:
-                for d in errors.get("data"):
-                    varUserId = d.get("varUserId")
-                    vmpJobId = d.get("vmpJobId")
-                    message = d.get("message")
-                    cursor.execute(
-                        f"UPDATE serviceHours SET status='ERRORED', error='{message}', updatedAt='{time.strftime('%Y-%m-%d %H:%M:%S')}' WHERE occurrenceId='{vmpJobId}' AND volunteerId='{varUserId}'"
-                    )
-                    cnxn.commit()
+                results.extend(
+                    sentResult(sent_rows, d, "ERRORED", d.get("message"))
+                    for d in errors.get("data")
+                )
+
+            database.writeServiceHourStatus(
+                cursor, [result for result in results if result is not None]
+            )
+            cnxn.commit()
 
             return (successes.get("total"), errors.get("total"))
         else:
@@ -170,14 +126,28 @@ def sendHours(accessToken, list, cnxn, cursor):
     return (0, len(list))
 
 
-def isUserLinked(accessToken, userId):
+# the writeServiceHourStatus result of the JC result d, None if d is not a pair that was sent
+def sentResult(sent_rows, d, status, error):
+    row = sent_rows.get((d.get("vmpJobId"), d.get("varUserId")))
+    if row is None:
+        return None
+    return (
+        row.occurrenceId,
+        row.volunteerId,
+        row.startDate,
+        row.endDate,
+        row.hours,
+        status,
+        error,
+    )
+
+
+def isUserLinked(userId):
     retries = 1
-    head = {"Authorization": "Bearer " + accessToken}
     while retries < 3:
-        r = requests.get(
-            f"https://{jc_api_url}/{jc_api_volunteer_linkage_path}?varUserId={userId}",
-            headers=head,
-        )
+        r = jc.linkage(userId)
+        if r is None:
+            break
         if r.status_code == 200:
             dict = r.json()
             # logging.info(dict)
@@ -0,0 +1,226 @@
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Query plans and timings of the batch functions' queue queries before and after the indexes of
+# migrations/V008__queue_indexes.sql, on a seeded dataset in session temp tables (nothing is written
+# to the real tables, any database the DB_* settings point at will do).
+# Run from the project root: python benchmarks/bench_indexes.py [occurrences]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations.migrate import migrations_dir, splitBatches
+from shared_code import database
+
+tables = {
+    "[dbo].[occurrences]": "#occurrences",
+    "[dbo].[serviceHours]": "#serviceHours",
+    "[dbo].[registrations]": "#registrations",
+}
+
+# the queries as the functions run them, on the temp tables
+queries = {
+    "batchOccurrences pending count": "SELECT COUNT(*) FROM #occurrences WHERE send=1",
+    "batchOccurrences keyset read": "SELECT TOP (100) occurrenceId, json FROM #occurrences WHERE send=1 AND occurrenceId > '' ORDER BY occurrenceId",
+    "batchServiceHours hours to send": "SELECT occurrenceId, volunteerId, startDate, endDate, hours FROM #serviceHours s WHERE s.status='NOT_SENT' AND EXISTS (SELECT 1 FROM #registrations r WHERE r.jcvarId = s.volunteerId AND r.status='LINKED') ORDER BY s.createdAt",
+    "batchRegistrations volunteers to link": "SELECT DISTINCT jcvarId FROM #registrations WHERE status='NOT_SENT'",
+}
+
+
+def createTables(cursor):
+    for table in tables.values():
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute(
+        """
+        CREATE TABLE #occurrences(
+            occurrenceId nvarchar(50) NOT NULL PRIMARY KEY CLUSTERED,
+            status varchar(16) NOT NULL,
+            createdAt datetime NOT NULL,
+            updatedAt datetime NULL,
+            json nvarchar(max) NOT NULL,
+            jsonHash char(64) NULL,
+            error varchar(128) NULL,
+            send bit NOT NULL
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE #serviceHours(
+            occurrenceId nvarchar(50) NOT NULL,
+            volunteerId nvarchar(128) NOT NULL,
+            startDate datetime NOT NULL,
+            endDate datetime NULL,
+            hours numeric(20, 2) NOT NULL,
+            status varchar(16) NOT NULL,
+            xml nvarchar(max) NULL,
+            createdAt datetime NOT NULL,
+            updatedAt datetime NULL,
+            error varchar(128) NULL,
+            payloadId int NULL,
+            notificationId nvarchar(18) NULL,
+            PRIMARY KEY CLUSTERED (occurrenceId, volunteerId)
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE #registrations(
+            hohkId nvarchar(50) NOT NULL,
+            jcvarId nvarchar(128) NOT NULL,
+            status varchar(16) NOT NULL,
+            xml nvarchar(max) NOT NULL,
+            createdAt datetime NOT NULL,
+            updatedAt datetime NULL,
+            error varchar(128) NULL
+        )
+        """
+    )
+
+
+# a mostly processed history: 2% of occurrences waiting to be sent, 1% of service hours NOT_SENT,
+# 90% of registrations LINKED and 1% waiting to be linked
+def seed(cursor, occurrence_count):
+    rng = random.Random(1)
+    start = datetime(2023, 1, 1)
+    volunteer_count = occurrence_count // 2
+    json_text = '{"vmpJobId": "x", "name": {"en": "' + "x" * 2000 + '"}}'
+
+    database.insertRows(
+        cursor,
+        "#occurrences",
+        ["occurrenceId", "status", "createdAt", "json", "send"],
+        [
+            (
+                f"a0C{i:015d}",
+                "SENT",
+                start + timedelta(minutes=i),
+                json_text,
+                rng.random() < 0.02,
+            )
+            for i in range(occurrence_count)
+        ],
+    )
+    database.insertRows(
+        cursor,
+        "#registrations",
+        ["hohkId", "jcvarId", "status", "xml", "createdAt"],
+        [
+            (
+                f"a0B{i:015d}",
+                f"var-{i:08d}",
+                "NOT_SENT" if r < 0.01 else "LINKED" if r < 0.91 else "ERRORED",
+                "<xml/>",
+                start + timedelta(minutes=i),
+            )
+            for i, r in ((i, rng.random()) for i in range(volunteer_count))
+        ],
+    )
+    service_hours = {}
+    for i in range(occurrence_count * 5):
+        key = (
+            f"a0C{rng.randrange(occurrence_count):015d}",
+            f"var-{rng.randrange(volunteer_count):08d}",
+        )
+        service_hours[key] = (
+            key[0],
+            key[1],
+            start + timedelta(hours=i),
+            start + timedelta(hours=i + 3),
+            3,
+            "NOT_SENT" if rng.random() < 0.01 else "SENT",
+            start + timedelta(hours=i),
+        )
+    database.insertRows(
+        cursor,
+        "#serviceHours",
+        [
+            "occurrenceId",
+            "volunteerId",
+            "startDate",
+            "endDate",
+            "hours",
+            "status",
+            "createdAt",
+        ],
+        list(service_hours.values()),
+    )
+    cursor.commit()
+
+
+def createIndexes(cursor):
+    path = os.path.join(migrations_dir, "V008__queue_indexes.sql")
+    with open(path, encoding="utf-8") as file:
+        batches = splitBatches(file.read())
+    for batch in batches:
+        for table, temp_table in tables.items():
+            batch = batch.replace(table, temp_table)
+        cursor.execute(batch)
+    cursor.commit()
+
+
+def plan(cursor, sql):
+    cursor.execute("SET SHOWPLAN_TEXT ON")
+    cursor.execute(sql)
+    lines = []
+    while True:
+        lines = [row[0] for row in cursor.fetchall()]
+        if not cursor.nextset():
+            break
+    cursor.execute("SET SHOWPLAN_TEXT OFF")
+    return lines
+
+
+def timing(cursor, sql, repeats):
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        cursor.execute(sql).fetchall()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def report(cursor, title, repeats):
+    print(f"== {title}")
+    results = {}
+    for name, sql in queries.items():
+        results[name] = timing(cursor, sql, repeats)
+        print(f"-- {name}: {results[name] * 1000:.2f} ms")
+        for line in plan(cursor, sql):
+            print(f"   {line.rstrip()}")
+    return results
+
+
+def main():
+    occurrence_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    repeats = 5
+
+    cnxn = database.getConnection()
+    if cnxn is None:
+        raise SystemExit("Could not connect to database")
+    cursor = cnxn.cursor()
+
+    createTables(cursor)
+    seed(cursor, occurrence_count)
+    before = report(cursor, "without indexes", repeats)
+    createIndexes(cursor)
+    after = report(cursor, "with V008 indexes", repeats)
+
+    print(f"== {occurrence_count} occurrences")
+    for name in queries:
+        print(
+            f"{name}: {before[name] * 1000:.2f} -> {after[name] * 1000:.2f} ms ({before[name] / after[name]:.1f}x)"
+        )
+
+    cursor.close()
+    database.releaseConnection(cnxn)
+
+
+if __name__ == "__main__":
+    import logging
+
+    logging.disable(logging.INFO)
+    main()
@@ -0,0 +1,213 @@
+import copy
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+# Throughput of the compiled occurrence mapping against the hand-written mapJSONData it replaced.
+# Run from the project root: python benchmarks/bench_mapping.py [occurrences]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared_code.mapping import (
+    causes_mapping,
+    location_mapping,
+    mapJSONData,
+    mapList,
+    mapLocation,
+    recipients_mapping,
+)
+
+
+# mapJSONData as it was before the declarative spec, pass in None if that language doesn't exist
+def legacyMapJSONData(json_dict_eng, json_dict_chi):
+    json_dict = {}
+    primary_dict = json_dict_eng
+    has_english = True if json_dict_eng is not None else False
+    has_chinese = True if json_dict_chi is not None else False
+    if has_english == False:
+        primary_dict = json_dict_chi
+
+    sdt = datetime.strptime(primary_dict["startDateTime"], "%Y-%m-%dT%H:%M:%S%z")
+    edt = datetime.strptime(primary_dict["endDateTime"], "%Y-%m-%dT%H:%M:%S%z")
+
+    json_dict["vmpJobId"] = primary_dict["occurrenceId"]
+    # The organiser ID has extra AAA characters at the end compared to the spreadsheet submitted by HOHK
+    if len(primary_dict["sponsoringOrganizationID"]) == 18:
+        primary_dict["sponsoringOrganizationID"] = primary_dict[
+            "sponsoringOrganizationID"
+        ][:-3]
+    json_dict["organiserId"] = primary_dict["sponsoringOrganizationID"]
+
+    json_dict["visibility"] = "public"
+    json_dict["isFull"] = (
+        primary_dict["maximumAttendance"] - primary_dict["volunteersNeeded"]
+    ) <= 0
+    json_dict["publishedAt"] = primary_dict["voCreatedDate"].replace("Z", ".000Z")
+
+    name = {}
+    if has_english:
+        name["en"] = json_dict_eng["title"]
+    else:
+        name["en"] = None
+
+    if has_chinese:
+        name["zh"] = json_dict_chi["title"]
+    else:
+        name["zh"] = None
+
+    json_dict["name"] = name
+
+    description = {}
+    if has_english:
+        description["en"] = json_dict_eng.get(
+            "description", "Please visit HandsOn Hong Kong to find out more."
+        ).strip()
+    else:
+        description["en"] = None
+
+    if has_chinese:
+        description["zh"] = json_dict_chi.get(
+            "description", "請瀏覽到HandsOn Hong Kong 網站了解更多。"
+        ).strip()
+    else:
+        description["zh"] = None
+
+    json_dict["description"] = description
+
+    json_dict["appImage"] = primary_dict["voThumbnailUrl"]  # Base64 image string 4:3
+    json_dict["webImage"] = primary_dict["voThumbnailUrl"]  # supposed to be 16:9
+    json_dict["url"] = primary_dict["detailUrl"]
+
+    json_dict["applicationStart"] = primary_dict["ocCreatedDate"].replace("Z", ".000Z")
+    json_dict["applicationEnd"] = (
+        (edt + timedelta(days=-1)).strftime("%Y-%m-%dT%H:%M:%SZ").replace("Z", ".000Z")
+    )
+    json_dict["serviceStart"] = primary_dict["startDateTime"].replace("Z", ".000Z")
+    json_dict["serviceEnd"] = primary_dict["endDateTime"].replace("Z", ".000Z")
+
+    schedules = {}
+    if has_english:
+        schedules["en"] = ("\n").join(
+            [
+                "Volunteer Service",
+                sdt.astimezone(pytz.timezone("Asia/Hong_Kong")).strftime(
+                    "%a, %d %B %Y %I:%M%p"
+                ),
+                edt.astimezone(pytz.timezone("Asia/Hong_Kong")).strftime(
+                    "%a, %d %B %Y %I:%M%p"
+                ),
+                json_dict_eng.get("locationAddress", ""),
+            ]
+        )
+    else:
+        schedules["en"] = None
+
+    if has_chinese:
+        schedules["zh"] = ("\n").join(
+            [
+                "義工服務",
+                sdt.astimezone(pytz.timezone("Asia/Hong_Kong")).strftime(
+                    "%a, %d %B %Y %I:%M%p"
+                ),
+                edt.astimezone(pytz.timezone("Asia/Hong_Kong")).strftime(
+                    "%a, %d %B %Y %I:%M%p"
+                ),
+                json_dict_chi.get("locationAddress", ""),
+            ]
+        )
+    else:
+        schedules["zh"] = None
+
+    json_dict["schedules"] = schedules
+    json_dict["quota"] = primary_dict["maximumAttendance"]
+
+    json_dict["locations"] = mapLocation(
+        json_dict_eng.get("locationAddress", "").strip() if has_english else "",
+        json_dict_chi.get("locationAddress", "").strip() if has_chinese else "",
+    )
+    if "categoryTags" in primary_dict:
+        json_dict["causes"] = mapList(
+            primary_dict["categoryTags"], causes_mapping, "Cause"
+        )
+
+    if "populationsServed" in primary_dict:
+        json_dict["recipients"] = mapList(
+            primary_dict["populationsServed"], recipients_mapping, "Recipient"
+        )
+
+    # if "Nlatitude" in primary_dict and "Nlongitude" in primary_dict:
+    #    json_dict['additionalInfo'] = {
+    #        'locationLatitude': primary_dict['Nlatitude'],
+    #        'locationLongitude': primary_dict['Nlongitude']
+    #    }
+
+    return json_dict
+
+
+def syntheticDocs(count):
+    locations = list(location_mapping.keys())
+    causes = list(causes_mapping.keys())
+    recipients = list(recipients_mapping.keys())
+    start = datetime(2023, 6, 1, 1, 0, tzinfo=timezone.utc)
+    pairs = []
+    for i in range(count):
+        # every occurrence gets its own start and end time so the date caches cannot help
+        sdt = start + timedelta(minutes=17 * i)
+        edt = sdt + timedelta(hours=3)
+        common = {
+            "occurrenceId": f"a0C{i:015d}",
+            "sponsoringOrganizationID": f"0011000000{i:05d}AAA",
+            "maximumAttendance": 20,
+            "volunteersNeeded": i % 25,
+            "voThumbnailUrl": f"https://example.org/images/{i}.png",
+            "voCreatedDate": "2023-01-05T02:00:00Z",
+            "detailUrl": f"https://example.org/opportunities/{i}",
+            "ocCreatedDate": "2023-01-06T02:00:00Z",
+            "startDateTime": sdt.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "endDateTime": edt.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "locationAddress": locations[i % len(locations)],
+            "categoryTags": [causes[i % len(causes)], "Unmapped cause"],
+            "populationsServed": [recipients[i % len(recipients)]],
+        }
+        eng = dict(
+            common,
+            Language="English",
+            title=f"Opportunity {i}",
+            description=" Help out. ",
+        )
+        chi = dict(common, Language="Chinese", title=f"義工活動 {i}")
+        pairs.append((eng, chi if i % 3 else None))
+    return pairs
+
+
+def run(function, pairs):
+    # legacy mapJSONData mutates its input, give every run its own copy
+    pairs = copy.deepcopy(pairs)
+    start = time.perf_counter()
+    results = [function(eng, chi) for eng, chi in pairs]
+    return (results, time.perf_counter() - start)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    pairs = syntheticDocs(count)
+
+    legacy_results, legacy_time = run(legacyMapJSONData, pairs)
+    compiled_results, compiled_time = run(mapJSONData, pairs)
+    if legacy_results != compiled_results:
+        raise SystemExit("compiled mapping does not match the legacy mapping")
+
+    print(f"{count} occurrences")
+    print(f"legacy mapJSONData:   {count / legacy_time:10.0f} docs/s")
+    print(f"compiled mapJSONData: {count / compiled_time:10.0f} docs/s")
+    print(f"speedup: {legacy_time / compiled_time:.2f}x")
+
+
+if __name__ == "__main__":
+    import logging
+
+    logging.disable(logging.INFO)
+    main()
@@ -0,0 +1,116 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import xmltodict
+
+# Parsing time and peak memory of the streaming outbound message reader against the xmltodict parse
+# (and json.dumps for the log) that collectServiceHours did before.
+# Run from the project root: python benchmarks/bench_outbound.py [repeats]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared_code import outbound
+
+fields = [
+    "HOC__Attendance_Status__c",
+    "HOC__Occurrence__c",
+    "HOC_Contact_JCVAR_UserId__c",
+    "HOC_Occurrence_Start_Date_Time__c",
+    "HOC_Occurrence_End_Date_Time__c",
+    "HOC__Number_Hours_Served__c",
+]
+
+
+# an outbound message with count HOC__Connection__c notifications, each also carrying fields nobody reads
+def syntheticEnvelope(count):
+    notifications = []
+    for i in range(count):
+        unused = "".join(
+            f"<sf:HOC__Unused_{n}__c>{'x' * 40}</sf:HOC__Unused_{n}__c>"
+            for n in range(30)
+        )
+        notifications.append(
+            f"""<Notification>
+<Id>04l0000000{i:08d}</Id>
+<sObject xsi:type="sf:HOC__Connection__c" xmlns:sf="urn:sobject.enterprise.soap.sforce.com">
+<sf:Id>a0B0000000{i:08d}</sf:Id>
+<sf:HOC__Attendance_Status__c>Attended (and Hours Verified)</sf:HOC__Attendance_Status__c>
+<sf:HOC__Number_Hours_Served__c>{1 + i % 8}.5</sf:HOC__Number_Hours_Served__c>
+<sf:HOC__Occurrence__c>a0C0000000{i:08d}</sf:HOC__Occurrence__c>
+<sf:HOC_Contact_JCVAR_UserId__c>var-{i:08d}</sf:HOC_Contact_JCVAR_UserId__c>
+<sf:HOC_Occurrence_End_Date_Time__c>2023-06-01T05:00:00.000Z</sf:HOC_Occurrence_End_Date_Time__c>
+<sf:HOC_Occurrence_Start_Date_Time__c>2023-06-01T01:00:00.000Z</sf:HOC_Occurrence_Start_Date_Time__c>
+{unused}
+</sObject>
+</Notification>"""
+        )
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<soapenv:Body>
+<notifications xmlns="http://soap.sforce.com/2005/09/outbound">
+<OrganizationId>00D000000000001</OrganizationId>
+<ActionId>04k000000000001</ActionId>
+<SessionId xsi:nil="true"/>
+<EnterpriseUrl>https://example.my.salesforce.com/services/Soap/c/57.0/00D000000000001</EnterpriseUrl>
+<PartnerUrl>https://example.my.salesforce.com/services/Soap/u/57.0/00D000000000001</PartnerUrl>
+{"".join(notifications)}
+</notifications>
+</soapenv:Body>
+</soapenv:Envelope>""".encode(
+        "utf-8"
+    )
+
+
+def xmltodictNotifications(body):
+    envelope = xmltodict.parse(body)
+    json.dumps(envelope)
+    notifications = envelope["soapenv:Envelope"]["soapenv:Body"]["notifications"]
+    entries = notifications["Notification"]
+    if not isinstance(entries, list):
+        entries = [entries]
+    return [
+        dict(
+            {name: entry["sObject"].get("sf:" + name) for name in fields},
+            notificationId=entry["Id"],
+        )
+        for entry in entries
+    ]
+
+
+def streamingNotifications(body):
+    return list(outbound.iterNotifications(body, fields))
+
+
+def run(function, body, repeats):
+    start = time.perf_counter()
+    for i in range(repeats):
+        result = function(body)
+    elapsed = (time.perf_counter() - start) / repeats
+
+    tracemalloc.start()
+    function(body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (result, elapsed, peak)
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    for count in (1, 10, 100):
+        body = syntheticEnvelope(count)
+        old_result, old_time, old_peak = run(xmltodictNotifications, body, repeats)
+        new_result, new_time, new_peak = run(streamingNotifications, body, repeats)
+        if old_result != new_result:
+            raise SystemExit("streaming reader does not match xmltodict")
+
+        print(f"{count} notification(s), {len(body)} bytes")
+        print(f"  xmltodict: {old_time * 1000:8.2f} ms {old_peak / 1024:8.0f} KiB peak")
+        print(f"  streaming: {new_time * 1000:8.2f} ms {new_peak / 1024:8.0f} KiB peak")
+        print(f"  speedup: {old_time / new_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,56 +3,31 @@ import os
 import azure.functions as func
 import pyodbc
 import requests
-from datetime import date
+from datetime import date, datetime, timedelta
 import time
 from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 import json
+import hashlib
 
-import azure.functions as func
+from shared_code import database, hohk, jc
 
-db_url = os.environ["DB_URL"]
-db = os.environ["DB"]
-db_username = os.environ["DB_USERNAME"]
-db_password = os.environ["DB_PASSWORD"]
-db_driver = os.environ["DB_DRIVER"]
-hohk_api_url = os.environ["HOHK_API_URL"]
-hohk_api_username = os.environ["HOHK_API_USERNAME"]
-hohk_api_password = os.environ["HOHK_API_PASSWORD"]
-
-occurrence_url_prefix = (
-    os.environ["THIS_API_URL"]
-    + "/occurrence?code="
-    + os.environ["OCCURRENCE_FUNCTION_CODE"]
-    + "&occurrenceId="
-)
-jobmap_url = (
-    os.environ["THIS_API_URL"] + "/jobmap?code=" + os.environ["JOBMAP_FUNCTION_CODE"]
+# number of SOLR batch requests kept in flight at once
+solr_concurrency = int(os.environ.get("SOLR_CONCURRENCY", "4"))
+# full: every active occurrence, delta: only those changed since the last sync,
+# auto: delta unless the last full sync is older than FULL_SYNC_INTERVAL_HOURS
+sync_mode = os.environ.get("CACHE_OCCURRENCES_MODE", "full")
+full_sync_interval = timedelta(
+    hours=int(os.environ.get("FULL_SYNC_INTERVAL_HOURS", "168"))
 )
+# SOLR and database clocks are not the same, delta queries start this far before the watermark
+sync_overlap = timedelta(minutes=10)
+# With UNLIST_WITHDRAWN=true a full run unlists the listed occurrences that left the active set before they ended
+unlist_withdrawn = os.environ.get("UNLIST_WITHDRAWN", "").lower() == "true"
 
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
-    # DB retry
-    cnxn = None
-    for i in range(0, 4):
-        while True:
-            try:
-                cnxn = pyodbc.connect(
-                    "DRIVER="
-                    + db_driver
-                    + ";SERVER="
-                    + db_url
-                    + ";PORT=1433;DATABASE="
-                    + db
-                    + ";UID="
-                    + db_username
-                    + ";PWD="
-                    + db_password
-                    + ";Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
-                )
-            except pyodbc.Error as ex:
-                time.sleep(2.0)
-                continue
-            break
+    cnxn = database.getConnection()
     if cnxn == None:
         logging.info("Could not connect to database")
         return func.HttpResponse("Could not obtain accessToken", status_code=400)
@@ -61,82 +36,93 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
     logging.info("Call cacheOccurences function.")
     start_time = time.time()
-    r = requests.get(jobmap_url)
-    json_response = r.json()
+    sync_start = datetime.utcnow()
+    watermark, last_full_sync = getSyncState(cursor)
+    mode = req.params.get("mode", sync_mode)
+    if mode == "auto":
+        mode = (
+            "delta"
+            if last_full_sync is not None
+            and sync_start - last_full_sync < full_sync_interval
+            else "full"
+        )
+    if mode != "delta" or watermark is None:
+        mode = "full"
+
+    since = watermark - sync_overlap if mode == "delta" else None
+    json_response = hohk.getActiveOccurrenceIds(since)
     batch_size = 100
 
     # sending it to SOLR with too many occurrenceIds (100+) seems to cause problems
-    l = []
-    for occurrence_batch in batched(json_response, batch_size):
-        occurrenceIds = ",".join(occurrence_batch)
-        r2 = requests.get(occurrence_url_prefix + occurrenceIds)
-
-        if r2.status_code == 200:
-            l.extend(r2.json())
-        else:
-            logging.error(
-                f"Received status code {r2.status_code} for {occurrence_url_prefix + occurrenceIds}"
-            )
+    l, failed_batches = fetchOccurrences(json_response, batch_size, solr_concurrency)
 
     # here, l contains everything that is a valid occurrence in SOLR
     # search DB for json_response where occurrenceId in jobmap results
-    ids = (",").join(f"'{w}'" for w in json_response)
+    # only the fingerprints are compared, json is only pulled for rows cached before jsonHash existed
+    database.stageRows(
+        cursor,
+        "#active_ids",
+        [("occurrenceId", "nvarchar(50) NOT NULL PRIMARY KEY")],
+        [(id,) for id in set(json_response)],
+    )
     rows = cursor.execute(
-        f"SELECT occurrenceId, json FROM occurrences WHERE occurrenceId IN ({ids})"
+        "SELECT o.occurrenceId, o.status, o.jsonHash, CASE WHEN o.jsonHash IS NULL THEN o.json END AS json FROM occurrences o JOIN #active_ids a ON a.occurrenceId = o.occurrenceId"
     ).fetchall()
-    in_db_ids = [row.occurrenceId for row in rows]
-    not_in_db_ids = [id for id in json_response if id not in in_db_ids]
-    in_db_json = [row.json for row in rows]
-
-    new_records = 0
-    updated_records = 0
-    same_records = 0
+    # occurrenceId -> row
+    in_db = {row.occurrenceId: row for row in rows}
+    not_in_db_ids = [id for id in json_response if id not in in_db]
 
+    # only new, changed and hash backfill rows are staged for the bulk merge
+    staged = []
     for dict in l:
         occurrenceId = dict.get("vmpJobId")
-        index = -1
-        try:
-            index = in_db_ids.index(occurrenceId)
-        except:
-            pass
-
-        if index >= 0:
-            # if in db, is json the same?
-            db_json_dict = json.loads(in_db_json[index])
-            if db_json_dict == dict:
+        json_data = canonicalJSON(dict)
+        json_hash = fingerprint(json_data)
+        row = in_db.get(occurrenceId)
+
+        if row is not None:
+            if row.status == "WITHDRAWN":
+                # unlisted by an earlier full run and active again, send it to list it again
+                staged.append((occurrenceId, json_data, json_hash, True))
+            elif row.jsonHash is None and json.loads(row.json) == dict:
+                # cached before jsonHash existed and unchanged, backfill the hash only
+                staged.append((occurrenceId, json_data, json_hash, False))
+            elif row.jsonHash == json_hash:
                 # logging.info("Same JSON, do nothing")
-                same_records += 1
+                pass
             else:
                 # logging.info("Different JSON, set send=1")
-                cursor.execute(
-                    f"UPDATE occurrences SET send=?, error=?, json=?, updatedAt=? WHERE occurrenceId=?",
-                    1,
-                    "",
-                    json.dumps(dict),
-                    time.strftime("%Y-%m-%d %H:%M:%S"),
-                    occurrenceId,
-                )
-                cnxn.commit()
-                updated_records += 1
+                staged.append((occurrenceId, json_data, json_hash, True))
         else:
             # if not in db, insert directly to db and set send bit to 1
-            cursor.execute(
-                f"INSERT INTO occurrences(occurrenceId, status, json, send, createdAt) VALUES (?, ?, ?, ?, ?)",
-                occurrenceId,
-                "NOT SENT",
-                json.dumps(dict),
-                1,
-                time.strftime("%Y-%m-%d %H:%M:%S"),
-            )
-            cnxn.commit()
-            new_records += 1
+            staged.append((occurrenceId, json_data, json_hash, True))
+
+    try:
+        new_records, updated_records = mergeOccurrences(cursor, staged)
+        # a batch that could not be fetched may hold changes, the next delta must look at them again
+        if failed_batches == 0:
+            saveSyncState(cursor, sync_start, mode == "full")
+        cnxn.commit()
+    except pyodbc.Error as err:
+        cnxn.rollback()
+        logging.error(f"Could not merge occurrences: {err}")
+        cursor.close()
+        database.releaseConnection(cnxn)
+        return func.HttpResponse("Could not merge occurrences", status_code=500)
+    same_records = len(l) - new_records - updated_records
+
+    # only a full run knows every active occurrence, the unfinished rows missing from it were withdrawn in HOHK
+    unlisted_records = 0
+    withdrawn_records = 0
+    if unlist_withdrawn and mode == "full" and len(json_response) > 0:
+        unlisted_records, withdrawn_records = unlistWithdrawn(cnxn, cursor)
 
     end_time = time.time()
 
     cursor.close()
-    cnxn.close()
+    database.releaseConnection(cnxn)
     return func.HttpResponse(
-        f"Total in SOLR: {len(json_response)}, Not in DB: {len(not_in_db_ids)}, In DB: {len(in_db_ids)}, Inserted: {new_records}, Unchanged: {same_records}, Updated: {updated_records}"
+        f"Mode: {mode}, Total in SOLR: {len(json_response)}, Not in DB: {len(not_in_db_ids)}, In DB: {len(in_db)}, Inserted: {new_records}, Unchanged: {same_records}, Updated: {updated_records}, Withdrawn: {withdrawn_records}, Unlisted: {unlisted_records}"
         + " in "
         + str(end_time - start_time)
         + " seconds",
@@ -144,6 +130,155 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     )
 
 
+# Applies the staged (occurrenceId, json, jsonHash, changed) rows with one set-based MERGE.
+# Changed rows are marked for sending, unchanged rows only get their jsonHash backfilled.
+# Does not commit, returns (inserted, updated)
+def mergeOccurrences(cursor, rows):
+    if len(rows) == 0:
+        return (0, 0)
+
+    database.stageRows(
+        cursor,
+        "#occurrences_staging",
+        [
+            ("occurrenceId", "nvarchar(50) NOT NULL PRIMARY KEY"),
+            ("json", "nvarchar(max) NOT NULL"),
+            ("jsonHash", "char(64) NOT NULL"),
+            ("changed", "bit NOT NULL"),
+        ],
+        rows,
+    )
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    counts = cursor.execute(
+        """
+        SET NOCOUNT ON;
+        DECLARE @actions TABLE(action nvarchar(10), changed bit);
+        MERGE occurrences WITH (HOLDLOCK) AS t
+        USING #occurrences_staging AS s ON t.occurrenceId = s.occurrenceId
+        WHEN MATCHED THEN UPDATE SET
+            send = CASE WHEN s.changed = 1 THEN 1 ELSE t.send END,
+            error = CASE WHEN s.changed = 1 THEN '' ELSE t.error END,
+            updatedAt = CASE WHEN s.changed = 1 THEN ? ELSE t.updatedAt END,
+            json = s.json,
+            jsonHash = s.jsonHash
+        WHEN NOT MATCHED THEN
+            INSERT (occurrenceId, status, json, jsonHash, send, createdAt)
+            VALUES (s.occurrenceId, 'NOT SENT', s.json, s.jsonHash, 1, ?)
+        OUTPUT $action, s.changed INTO @actions;
+        SELECT
+            COUNT(CASE WHEN action = 'INSERT' THEN 1 END) AS inserted,
+            COUNT(CASE WHEN action = 'UPDATE' AND changed = 1 THEN 1 END) AS updated
+        FROM @actions;
+        SET NOCOUNT OFF;
+        """,
+        now,
+        now,
+    ).fetchone()
+    return (counts.inserted, counts.updated)
+
+
+# Unlists the occurrences listed in JC (SENT) that are not in #active_ids (the active set of a full run) although
+# their serviceEnd is still to come, and marks them WITHDRAWN. Occurrences that ended leave the active set too and
+# are left to expire in JC. Those JC could not unlist are tried again by the next full run, occurrences unlisted
+# by hand through the unlist function stay UNLISTED and are left alone.
+# returns (unlisted, withdrawn)
+def unlistWithdrawn(cnxn, cursor):
+    withdrawn_ids = [row.occurrenceId for row in cursor.execute("""
+            SELECT o.occurrenceId FROM occurrences o
+            WHERE o.status = 'SENT'
+            AND TRY_CONVERT(datetimeoffset, JSON_VALUE(o.json, '$.serviceEnd'), 127) > SYSDATETIMEOFFSET()
+            AND NOT EXISTS (SELECT 1 FROM #active_ids a WHERE a.occurrenceId = o.occurrenceId)
+            """).fetchall()]
+    if len(withdrawn_ids) == 0:
+        return (0, 0)
+    if jc.getAccessToken() is None:
+        logging.error(
+            f"Could not obtain accessToken, {len(withdrawn_ids)} withdrawn occurrences are left listed"
+        )
+        return (0, len(withdrawn_ids))
+
+    unlisted = 0
+    for batch in batched(withdrawn_ids, 100):
+        try:
+            r = jc.unlist(batch)
+        except requests.RequestException as err:
+            logging.error(f"Could not unlist occurrences {','.join(batch)}: {err}")
+            continue
+        if r is None or r.status_code != 200:
+            logging.error(
+                f"Could not unlist occurrences {','.join(batch)}: {None if r is None else r.status_code}"
+            )
+            continue
+
+        dict = r.json()
+        successes = dict.get("success")
+        errors = dict.get("error")
+        if errors.get("total") > 0:
+            logging.error(f"JC did not unlist {errors.get('data')}")
+        if successes.get("total") > 0:
+            unlisted += database.writeOccurrenceStatus(
+                cursor, [(id, "WITHDRAWN", "") for id in successes.get("ids")]
+            )
+            cnxn.commit()
+    return (unlisted, len(withdrawn_ids))
+
+
+# returns (watermark, lastFullSync) of the last successful cacheOccurrences run, both None before the first one
+def getSyncState(cursor):
+    row = cursor.execute(
+        "SELECT watermark, lastFullSync FROM syncState WHERE name='occurrences'"
+    ).fetchone()
+    if row is None:
+        return (None, None)
+    return (row.watermark, row.lastFullSync)
+
+
+# Does not commit
+def saveSyncState(cursor, watermark, full):
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    cursor.execute(
+        """
+        MERGE syncState AS t
+        USING (SELECT 'occurrences' AS name, ? AS watermark, ? AS lastFullSync) AS s
+        ON t.name = s.name
+        WHEN MATCHED THEN UPDATE SET
+            watermark = s.watermark,
+            lastFullSync = COALESCE(s.lastFullSync, t.lastFullSync),
+            updatedAt = ?
+        WHEN NOT MATCHED THEN
+            INSERT (name, watermark, lastFullSync, updatedAt)
+            VALUES (s.name, s.watermark, s.lastFullSync, ?);
+        """,
+        watermark,
+        watermark if full else None,
+        now,
+        now,
+    )
+
+
+# fetches the occurrences in batches of batch_size ids with up to max_workers requests in flight
+# returns (occurrences, number of batches that could not be fetched)
+def fetchOccurrences(occurrenceIds, batch_size, max_workers):
+    l = []
+    failed_batches = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            (occurrence_batch, executor.submit(hohk.getOccurrences, occurrence_batch))
+            for occurrence_batch in batched(occurrenceIds, batch_size)
+        ]
+        for occurrence_batch, future in futures:
+            try:
+                occurrences, missing_ids = future.result()
+                l.extend(occurrences)
+            except Exception as err:
+                # a SOLR error or a doc the mapping cannot handle only fails its own batch
+                failed_batches += 1
+                logging.error(
+                    f"Could not get occurrences {','.join(occurrence_batch)}: {err}"
+                )
+    return (l, failed_batches)
+
+
 def batched(iterable, n):
     "Batch data into lists of length n. The last batch may be shorter."
     # batched('ABCDEFG', 3) --> ABC DEF G
@@ -152,3 +287,12 @@ def batched(iterable, n):
     it = iter(iterable)
     while batch := list(islice(it, n)):
         yield batch
+
+
+def canonicalJSON(dict):
+    # stable serialization so that equal occurrences always produce the same string
+    return json.dumps(dict, sort_keys=True, separators=(",", ":"))
+
+
+def fingerprint(json_data):
+    return hashlib.sha256(json_data.encode("utf-8")).hexdigest()
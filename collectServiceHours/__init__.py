@@ -1,17 +1,31 @@
+import json
 import logging
 import os
-import pyodbc
-import time
-import json
-import xmltodict
+import typing
+from datetime import datetime
+from itertools import islice
 
 import azure.functions as func
 
-db_url = os.environ["DB_URL"]
-db = os.environ["DB"]
-db_username = os.environ["DB_USERNAME"]
-db_password = os.environ["DB_PASSWORD"]
-db_driver = os.environ["DB_DRIVER"]
+from shared_code import database, outbound
+
+# the sObject fields of a HOC__Connection__c notification read by this function
+service_hour_fields = [
+    "HOC__Attendance_Status__c",
+    "HOC__Occurrence__c",
+    "HOC_Contact_JCVAR_UserId__c",
+    "HOC_Occurrence_Start_Date_Time__c",
+    "HOC_Occurrence_End_Date_Time__c",
+    "HOC__Number_Hours_Served__c",
+    "SystemModstamp",
+]
+# With SERVICE_HOURS_SPOOL=queue the notifications are written to the servicehours-spool storage queue
+# and acked without touching the database, drainServiceHours then inserts them in batches.
+spool_enabled = os.environ.get("SERVICE_HOURS_SPOOL", "").lower() == "queue"
+spool_rows_per_message = int(os.environ.get("SPOOL_ROWS_PER_MESSAGE", "50"))
+# queue messages are limited to 64 KiB and the binding base64 encodes them,
+# the envelope is only spooled along with its rows when it fits
+spool_message_max_bytes = 48 * 1024
 
 
 xml_res = """<?xml version="1.0" encoding="UTF-8"?>
@@ -24,111 +38,140 @@ xml_res = """<?xml version="1.0" encoding="UTF-8"?>
 </soapenv:Envelope>"""
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
-    # DB retry
-    cnxn = None
-    for i in range(0, 4):
-        while True:
-            try:
-                cnxn = pyodbc.connect(
-                    "DRIVER="
-                    + db_driver
-                    + ";SERVER="
-                    + db_url
-                    + ";PORT=1433;DATABASE="
-                    + db
-                    + ";UID="
-                    + db_username
-                    + ";PWD="
-                    + db_password
-                    + ";Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
-                )
-            except pyodbc.Error as ex:
-                time.sleep(2.0)
-                continue
-            break
+def main(req: func.HttpRequest, spool: func.Out[typing.List[str]]) -> func.HttpResponse:
+    logging.info("Python HTTP trigger function processed a request.")
+    # logging.info(req.get_body())
+
+    try:
+        body = req.get_body()
+        rows, notification_count = readServiceHours(body)
+    except Exception as err:
+        logging.error(f"Unexpected {err=}, {type(err)=}")
+        return ackResponse(False)
+
+    if spool_enabled:
+        if len(rows) > 0:
+            spool.set(spoolMessages(body, rows))
+        logging.info(
+            f"Spooled {len(rows)} of {notification_count} service hour notification(s)"
+        )
+        return ackResponse(True)
+
+    cnxn = database.getConnection()
     if cnxn == None:
         logging.info("Could not connect to database")
         return func.HttpResponse("Could not obtain accessToken", status_code=400)
 
     cursor = cnxn.cursor()
 
-    logging.info("Python HTTP trigger function processed a request.")
-    # logging.info(req.get_body())
-
     try:
-        dict = xmltodict.parse(req.get_body())
-        json_data = json.dumps(dict)
-        logging.info(json_data)
-        connection_data = {}
-
-        # this can either be a list if multiple entries are marked as served when the form is sent
-        is_list = isinstance(
-            dict["soapenv:Envelope"]["soapenv:Body"]["notifications"]["Notification"],
-            list,
+        # the envelope is stored once and referenced by all of its rows, which are inserted together
+        if len(rows) > 0:
+            payloadId = database.saveServiceHourPayload(cursor, body.decode("utf-8"))
+            database.writeServiceHours(cursor, [row + (payloadId,) for row in rows])
+            cnxn.commit()
+        logging.info(
+            f"Collected {len(rows)} of {notification_count} service hour notification(s)"
         )
 
-        all_connection_data = []
-        if is_list:
-            all_connection_data = dict["soapenv:Envelope"]["soapenv:Body"][
-                "notifications"
-            ]["Notification"]
-        else:
-            all_connection_data.append(
-                dict["soapenv:Envelope"]["soapenv:Body"]["notifications"][
-                    "Notification"
-                ]
-            )
-
-        # logging.info(connection_data)
-        for entry in all_connection_data:
-            connection_data = entry["sObject"]
-            attendance_status = connection_data.get("sf:HOC__Attendance_Status__c")
-            # logging.info(f"Attendence Status {attendance_status}")
-            if attendance_status == "Attended (and Hours Verified)":
-                occurrenceId = connection_data.get("sf:HOC__Occurrence__c")  # vmpJobId
-                userId = connection_data.get(
-                    "sf:HOC_Contact_JCVAR_UserId__c"
-                )  # varUserId
-                sdt = connection_data.get(
-                    "sf:HOC_Occurrence_Start_Date_Time__c"
-                )  # startDateTime In ISO 8601 datetime format with UTC.
-                edt = connection_data.get(
-                    "sf:HOC_Occurrence_End_Date_Time__c"
-                )  # endDateTime
-                hours = float(
-                    connection_data.get("sf:HOC__Number_Hours_Served__c")
-                )  # hour
-
-                # logging.info(f"{occurrenceId} {userId} {sdt} {edt} {hours}")
-                cursor.execute(
-                    f"INSERT INTO serviceHours(occurrenceId, volunteerId, startDate, endDate, hours, status, xml, createdAt, updatedAt) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                    occurrenceId,
-                    userId,
-                    sdt,
-                    edt,
-                    hours,
-                    "NOT_SENT",
-                    json_data,
-                    time.strftime("%Y-%m-%d %H:%M:%S"),
-                    None,
-                )
-                cnxn.commit()
-
         cursor.close()
-        cnxn.close()
-        return func.HttpResponse(
-            xml_res.replace("REPLACE", "true"),
-            status_code=200,
-            headers={"content-type": "application/xml"},
-        )
+        database.releaseConnection(cnxn)
+        return ackResponse(True)
     except Exception as err:
         logging.error(f"Unexpected {err=}, {type(err)=}")
 
     cursor.close()
-    cnxn.close()
+    database.releaseConnection(cnxn)
+    return ackResponse(False)
+
+
+def ackResponse(ack):
     return func.HttpResponse(
-        xml_res.replace("REPLACE", "false"),
+        xml_res.replace("REPLACE", "true" if ack else "false"),
         status_code=200,
         headers={"content-type": "application/xml"},
     )
+
+
+# returns ([(notificationId, occurrenceId, volunteerId, startDate, endDate, hours, modifiedAt)], number of notifications)
+# for the attended notifications in the outbound message body
+def readServiceHours(body):
+    notification_count = 0
+    rows = []
+    # there can be several Notifications if multiple entries are marked as served when the form is sent
+    for connection_data in outbound.iterNotifications(body, service_hour_fields):
+        notification_count += 1
+        attendance_status = connection_data.get("HOC__Attendance_Status__c")
+        # logging.info(f"Attendence Status {attendance_status}")
+        if attendance_status == "Attended (and Hours Verified)":
+            occurrenceId = connection_data.get("HOC__Occurrence__c")  # vmpJobId
+            userId = connection_data.get("HOC_Contact_JCVAR_UserId__c")  # varUserId
+            sdt = connection_data.get(
+                "HOC_Occurrence_Start_Date_Time__c"
+            )  # startDateTime In ISO 8601 datetime format with UTC.
+            edt = connection_data.get("HOC_Occurrence_End_Date_Time__c")  # endDateTime
+            hours = connection_data.get("HOC__Number_Hours_Served__c")  # hour
+            # when the connection was last saved, an older notification never overwrites a newer one
+            modified = connection_data.get("SystemModstamp")
+
+            # a row the database would refuse is dropped here, a redelivery would not make it valid
+            error = invalidServiceHour(occurrenceId, userId, sdt, edt, hours, modified)
+            if error is not None:
+                logging.error(
+                    f"Skipping notification {connection_data['notificationId']}: {error}"
+                )
+                continue
+
+            # logging.info(f"{occurrenceId} {userId} {sdt} {edt} {hours}")
+            rows.append(
+                (
+                    connection_data["notificationId"],
+                    occurrenceId,
+                    userId,
+                    sdt,
+                    edt,
+                    float(hours),
+                    modified,
+                )
+            )
+    return (rows, notification_count)
+
+
+# returns why the fields cannot be stored as a serviceHours row, None if they can
+def invalidServiceHour(occurrenceId, userId, sdt, edt, hours, modified):
+    if not occurrenceId:
+        return "no HOC__Occurrence__c"
+    if not userId:
+        return "no HOC_Contact_JCVAR_UserId__c"
+    if not sdt:
+        return "no HOC_Occurrence_Start_Date_Time__c"
+    for name, value in (
+        ("HOC_Occurrence_Start_Date_Time__c", sdt),
+        ("HOC_Occurrence_End_Date_Time__c", edt),
+        ("SystemModstamp", modified),
+    ):
+        if value:
+            try:
+                datetime.fromisoformat(value.replace("Z", "+00:00"))
+            except ValueError:
+                return f"{name} {value} is not a date"
+    try:
+        float(hours)
+    except (TypeError, ValueError):
+        return f"HOC__Number_Hours_Served__c {hours} is not a number"
+    return None
+
+
+# returns the queue messages for rows, SPOOL_ROWS_PER_MESSAGE rows each, the first one also carries the envelope if it fits
+def spoolMessages(body, rows):
+    messages = []
+    it = iter(rows)
+    while batch := list(islice(it, spool_rows_per_message)):
+        message = {"rows": batch}
+        if len(messages) == 0:
+            with_envelope = json.dumps(dict(message, envelope=body.decode("utf-8")))
+            if len(with_envelope.encode("utf-8")) <= spool_message_max_bytes:
+                messages.append(with_envelope)
+                continue
+        messages.append(json.dumps(message))
+    return messages
@@ -0,0 +1,153 @@
+import datetime
+import json
+import logging
+import os
+import time
+import azure.functions as func
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.storage.queue import (
+    QueueClient,
+    TextBase64DecodePolicy,
+    TextBase64EncodePolicy,
+)
+
+from shared_code import database
+
+# Flushes the service hours spooled by collectServiceHours (SERVICE_HOURS_SPOOL=queue) to serviceHours.
+# Messages are only deleted once their rows are committed, rows are upserted by (occurrenceId, volunteerId)
+# so messages that are received again after a failed run are not inserted twice.
+
+# same setting as collectServiceHours, there is nothing to drain without it
+spool_enabled = os.environ.get("SERVICE_HOURS_SPOOL", "").lower() == "queue"
+spool_queue = "servicehours-spool"
+# messages that still cannot be written after this many receives are moved here
+spool_poison_queue = "servicehours-spool-poison"
+spool_max_dequeue_count = int(os.environ.get("SPOOL_MAX_DEQUEUE_COUNT", "5"))
+# messages inserted per commit
+spool_drain_batch = int(os.environ.get("SPOOL_DRAIN_BATCH", "500"))
+# messages are hidden from other receivers this long while a batch is written
+spool_visibility_timeout = int(os.environ.get("SPOOL_VISIBILITY_TIMEOUT", "300"))
+
+
+def main(mytimer: func.TimerRequest) -> None:
+    utc_timestamp = (
+        datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
+    )
+
+    if mytimer.past_due:
+        logging.info("The timer is past due!")
+
+    logging.info("Python timer trigger function ran at %s", utc_timestamp)
+
+    if not spool_enabled:
+        return
+
+    queue = QueueClient.from_connection_string(
+        os.environ["AzureWebJobsStorage"],
+        spool_queue,
+        message_decode_policy=TextBase64DecodePolicy(),
+    )
+
+    start_time = time.time()
+    message_count = 0
+    inserted_count = 0
+    cnxn = None
+    while True:
+        try:
+            messages = list(
+                queue.receive_messages(
+                    messages_per_page=32,
+                    visibility_timeout=spool_visibility_timeout,
+                    max_messages=spool_drain_batch,
+                )
+            )
+        except ResourceNotFoundError:
+            # the output binding only creates the queue with the first spooled notification
+            messages = []
+        if len(messages) == 0:
+            break
+
+        if cnxn is None:
+            cnxn = database.getConnection()
+            if cnxn is None:
+                # the messages become visible again after the timeout and are drained by a later run
+                logging.info("Could not connect to database")
+                return
+            cursor = cnxn.cursor()
+
+        try:
+            inserted_count += writeMessages(cursor, messages)
+            cnxn.commit()
+            done = messages
+        except Exception as err:
+            cnxn.rollback()
+            logging.error(
+                f"Could not write a batch of {len(messages)} spooled messages, retrying them one by one: {err}"
+            )
+            done = []
+            for message in messages:
+                try:
+                    inserted_count += writeMessages(cursor, [message])
+                    cnxn.commit()
+                    done.append(message)
+                except Exception as err:
+                    cnxn.rollback()
+                    if message.dequeue_count >= spool_max_dequeue_count:
+                        movePoisonMessage(message, err)
+                        done.append(message)
+                    else:
+                        logging.error(
+                            f"Could not write spooled message {message.id}, left for a later run: {err}"
+                        )
+
+        for message in done:
+            queue.delete_message(message)
+        message_count += len(done)
+
+    if cnxn is not None:
+        cursor.close()
+        database.releaseConnection(cnxn)
+
+    end_time = time.time()
+    logging.info(
+        f"Drained {message_count} spooled message(s), inserted {inserted_count} service hour(s). Time: {str(end_time-start_time)}s"
+    )
+
+
+# copies message to the poison queue, the caller deletes it from the spool
+def movePoisonMessage(message, err):
+    logging.error(
+        f"Moving spooled message {message.id} to {spool_poison_queue} after {message.dequeue_count} attempts: {err}"
+    )
+    poison = QueueClient.from_connection_string(
+        os.environ["AzureWebJobsStorage"],
+        spool_poison_queue,
+        message_encode_policy=TextBase64EncodePolicy(),
+    )
+    try:
+        poison.create_queue()
+    except ResourceExistsError:
+        pass
+    poison.send_message(message.content)
+
+
+# Inserts the rows of messages, their envelopes are stored first. Does not commit, returns the number of inserted rows
+def writeMessages(cursor, messages):
+    rows = []
+    for message in messages:
+        try:
+            spooled = json.loads(message.content)
+        except ValueError as err:
+            # deleted with the rest of the batch, it would never become readable
+            logging.error(f"Dropping unreadable spooled message {message.id}: {err}")
+            continue
+
+        payloadId = None
+        if spooled.get("envelope"):
+            payloadId = database.saveServiceHourPayload(cursor, spooled["envelope"])
+        # rows spooled before modifiedAt was read have no SystemModstamp
+        rows.extend(
+            tuple(row) + (None,) * (7 - len(row)) + (payloadId,)
+            for row in spooled["rows"]
+        )
+    return database.writeServiceHours(cursor, rows)
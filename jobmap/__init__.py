@@ -1,35 +1,33 @@
 import logging
-import os
 import azure.functions as func
-import requests
 import json
-import time
+from datetime import datetime
 
-hohk_api_url = os.environ["HOHK_API_URL"]
-hohk_api_username = os.environ["HOHK_API_USERNAME"]
-hohk_api_password = os.environ["HOHK_API_PASSWORD"]
+from shared_code import hohk
 
 
 # Creates a list of valid occurrences as of today
+# ?since=2023-06-01T00:00:00Z limits it to occurrences created or modified since then
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("Python Jobmap function processed a request.")
-    unixtime = int(time.time() * 1000)
-    query = "?rows=10000&fl=occurrenceId&group=true&group.field=occurrenceId&group.format=simple&group.main=true&group.limit=1&group.ngroups=true&wt=csv&q=IsOccurrenceActive:true%20AND%20IsOrganizationServedActive:true%20AND%20IsOpportunityActive:true%20AND%20-invitationCode:*"
-    query += '%20AND%20scheduleType:"Date%20%26%20Time%20Specific"'
+    since = req.params.get("since")
+    if since:
+        try:
+            since = datetime.strptime(since, "%Y-%m-%dT%H:%M:%SZ")
+        except ValueError:
+            return func.HttpResponse(
+                "Please pass since as YYYY-MM-DDTHH:MM:SSZ", status_code=400
+            )
 
-    # Add criteria 1: At least 4 volunteer spots open
-    # query += "%20AND%20volunteersNeeded:[4%20TO%20*]"
-
-    # Add criteria 2: Add occurences: now <= (occurence start date) <= 2 months from now
-    query += f"%20AND%20endDateTime:[NOW%20TO%20NOW%2B2MONTHS]&NOW={unixtime}"
-
-    r = requests.get(hohk_api_url + query, auth=(hohk_api_username, hohk_api_password))
-    to_add = r.text.split()
-    to_add.remove("occurrenceId")  # even if list is empty we will still get the header
+    # the ids are serialized page by page as SOLR returns them
+    body = (
+        "["
+        + ",".join(json.dumps(id) for id in hohk.iterActiveOccurrenceIds(since or None))
+        + "]"
+    )
 
     return func.HttpResponse(
-        # json.dumps(all_occurrences),
-        json.dumps(to_add),
+        body,
         mimetype="application/json",
         status_code=200,
     )
@@ -0,0 +1,10 @@
+/****** Adds the content fingerprint used by cacheOccurrences to detect changes ******/
+/****** Existing rows are backfilled by the next cacheOccurrences run ******/
+SET ANSI_NULLS ON
+GO
+
+SET QUOTED_IDENTIFIER ON
+GO
+
+ALTER TABLE [dbo].[occurrences] ADD [jsonHash] [char](64) NULL
+GO
@@ -0,0 +1,18 @@
+/****** Object:  Table [dbo].[syncState]    Watermarks of the incremental cacheOccurrences runs ******/
+SET ANSI_NULLS ON
+GO
+
+SET QUOTED_IDENTIFIER ON
+GO
+
+CREATE TABLE [dbo].[syncState](
+	[name] [varchar](32) NOT NULL,
+	[watermark] [datetime] NOT NULL,
+	[lastFullSync] [datetime] NULL,
+	[updatedAt] [datetime] NOT NULL,
+ CONSTRAINT [PK_syncState] PRIMARY KEY CLUSTERED 
+(
+	[name] ASC
+)WITH (STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, OPTIMIZE_FOR_SEQUENTIAL_KEY = OFF) ON [PRIMARY]
+) ON [PRIMARY]
+GO
@@ -0,0 +1,25 @@
+/****** Object:  Table [dbo].[imageCache]    Base64 thumbnails used by batchOccurrences ******/
+/****** Only a cache, its rows can be deleted at any time ******/
+SET ANSI_NULLS ON
+GO
+
+SET QUOTED_IDENTIFIER ON
+GO
+
+CREATE TABLE [dbo].[imageCache](
+	[urlHash] [char](64) NOT NULL,
+	[url] [nvarchar](2048) NOT NULL,
+	[etag] [nvarchar](256) NULL,
+	[lastModified] [nvarchar](64) NULL,
+	[params] [varchar](64) NOT NULL,
+	[appB64] [varchar](max) NOT NULL,
+	[webB64] [varchar](max) NOT NULL,
+	[bytes] [int] NOT NULL,
+	[fetchedAt] [datetime] NOT NULL,
+	[usedAt] [datetime] NOT NULL,
+ CONSTRAINT [PK_imageCache] PRIMARY KEY CLUSTERED 
+(
+	[urlHash] ASC
+)WITH (STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, OPTIMIZE_FOR_SEQUENTIAL_KEY = OFF) ON [PRIMARY]
+) ON [PRIMARY] TEXTIMAGE_ON [PRIMARY]
+GO
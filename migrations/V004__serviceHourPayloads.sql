@@ -0,0 +1,17 @@
+/****** Object:  Table [dbo].[serviceHourPayloads]    Outbound message envelopes received by collectServiceHours ******/
+SET ANSI_NULLS ON
+GO
+
+SET QUOTED_IDENTIFIER ON
+GO
+
+CREATE TABLE [dbo].[serviceHourPayloads](
+	[payloadId] [int] IDENTITY(1,1) NOT NULL,
+	[envelope] [nvarchar](max) NOT NULL,
+	[createdAt] [datetime] NOT NULL,
+ CONSTRAINT [PK_serviceHourPayloads] PRIMARY KEY CLUSTERED 
+(
+	[payloadId] ASC
+)WITH (STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, OPTIMIZE_FOR_SEQUENTIAL_KEY = OFF) ON [PRIMARY]
+) ON [PRIMARY] TEXTIMAGE_ON [PRIMARY]
+GO
@@ -0,0 +1,13 @@
+/****** Rows now reference their envelope in serviceHourPayloads instead of each holding a copy in xml ******/
+/****** Existing rows keep their xml, new rows leave it NULL ******/
+SET ANSI_NULLS ON
+GO
+
+SET QUOTED_IDENTIFIER ON
+GO
+
+ALTER TABLE [dbo].[serviceHours] ADD [payloadId] [int] NULL
+GO
+
+ALTER TABLE [dbo].[serviceHours] ALTER COLUMN [xml] [nvarchar](max) NULL
+GO
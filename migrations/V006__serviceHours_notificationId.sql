@@ -0,0 +1,17 @@
+/****** Keeps the Salesforce Notification Id of each row so redelivered or replayed notifications are only inserted once ******/
+/****** Rows inserted before have no notificationId and are not covered ******/
+SET ANSI_NULLS ON
+GO
+
+SET QUOTED_IDENTIFIER ON
+GO
+
+ALTER TABLE [dbo].[serviceHours] ADD [notificationId] [nvarchar](18) NULL
+GO
+
+CREATE UNIQUE NONCLUSTERED INDEX [UX_serviceHours_notificationId] ON [dbo].[serviceHours]
+(
+	[notificationId] ASC
+)
+WHERE [notificationId] IS NOT NULL
+GO
@@ -0,0 +1,21 @@
+/****** Makes (occurrenceId, volunteerId) the primary key of serviceHours, collectServiceHours upserts by it ******/
+/****** Duplicate rows left by Salesforce retries and re-saves are removed first, the latest row of each pair is kept ******/
+SET ANSI_NULLS ON
+GO
+
+SET QUOTED_IDENTIFIER ON
+GO
+
+WITH ranked AS (
+	SELECT ROW_NUMBER() OVER (PARTITION BY [occurrenceId], [volunteerId] ORDER BY [createdAt] DESC, [updatedAt] DESC) AS [n]
+	FROM [dbo].[serviceHours]
+)
+DELETE FROM ranked WHERE [n] > 1
+GO
+
+ALTER TABLE [dbo].[serviceHours] ADD CONSTRAINT [PK_serviceHours] PRIMARY KEY CLUSTERED 
+(
+	[occurrenceId] ASC,
+	[volunteerId] ASC
+)WITH (STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, OPTIMIZE_FOR_SEQUENTIAL_KEY = OFF) ON [PRIMARY]
+GO
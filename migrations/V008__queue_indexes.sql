@@ -0,0 +1,40 @@
+/****** Filtered indexes for the queue predicates of the batch functions ******/
+/****** Each index only holds the rows waiting in its queue, so it stays small as the tables grow ******/
+SET ANSI_NULLS ON
+GO
+
+SET QUOTED_IDENTIFIER ON
+GO
+
+/****** batchOccurrences: COUNT(*) and keyset reads of send=1 in occurrenceId order, json comes from the clustered index ******/
+CREATE NONCLUSTERED INDEX [IX_occurrences_send] ON [dbo].[occurrences]
+(
+	[occurrenceId] ASC
+)
+WHERE [send] = 1
+GO
+
+/****** batchServiceHours: NOT_SENT hours to send, covering apart from occurrenceId which is in the clustered key ******/
+CREATE NONCLUSTERED INDEX [IX_serviceHours_notSent] ON [dbo].[serviceHours]
+(
+	[volunteerId] ASC
+)
+INCLUDE ([startDate], [endDate], [hours], [createdAt])
+WHERE [status] = 'NOT_SENT'
+GO
+
+/****** batchServiceHours: EXISTS of a LINKED registration for serviceHours.volunteerId ******/
+CREATE NONCLUSTERED INDEX [IX_registrations_linked] ON [dbo].[registrations]
+(
+	[jcvarId] ASC
+)
+WHERE [status] = 'LINKED'
+GO
+
+/****** batchRegistrations: volunteers to link and the write back of their results ******/
+CREATE NONCLUSTERED INDEX [IX_registrations_notSent] ON [dbo].[registrations]
+(
+	[jcvarId] ASC
+)
+WHERE [status] = 'NOT_SENT'
+GO
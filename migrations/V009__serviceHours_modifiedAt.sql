@@ -0,0 +1,10 @@
+/****** Keeps the Salesforce SystemModstamp of each row so an older notification delivered late does not overwrite newer hours ******/
+/****** Rows inserted before have no modifiedAt and are updated by the next notification of their pair ******/
+SET ANSI_NULLS ON
+GO
+
+SET QUOTED_IDENTIFIER ON
+GO
+
+ALTER TABLE [dbo].[serviceHours] ADD [modifiedAt] [datetime] NULL
+GO
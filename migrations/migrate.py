@@ -0,0 +1,127 @@
+import os
+import re
+import sys
+
+# Applies the versioned migration scripts in this folder (V<version>__<name>.sql) that the database
+# has not seen yet, in version order. Each script runs in its own transaction together with its row
+# in schemaVersions, so a failed script leaves nothing behind and is tried again by the next run.
+# A new database is created with the table scripts next to the functions (occurrences.sql,
+# registrations.sql, serviceHours.sql) and then brought up to date by the migrations. A database the
+# scripts up to V<version> were already run on by hand is marked as such with --baseline <version>.
+# --dry-run only lists the pending scripts and changes nothing, not even schemaVersions.
+# Uses the same DB_* settings as the functions.
+# Run from the project root: python migrations/migrate.py [--dry-run] [--baseline <version>]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared_code import database
+
+migrations_dir = os.path.dirname(os.path.abspath(__file__))
+script_name = re.compile(r"^V(\d+)__(\w+)\.sql$")
+# scripts are split into batches on GO lines, like sqlcmd and SSMS do
+batch_separator = re.compile(r"^\s*GO\s*$", re.IGNORECASE | re.MULTILINE)
+
+
+# returns [(version, name, path)] of the scripts in version order
+def listMigrations():
+    migrations = []
+    for file_name in os.listdir(migrations_dir):
+        match = script_name.match(file_name)
+        if match:
+            migrations.append(
+                (
+                    int(match.group(1)),
+                    match.group(2),
+                    os.path.join(migrations_dir, file_name),
+                )
+            )
+    migrations.sort()
+    versions = [version for version, name, path in migrations]
+    if len(versions) != len(set(versions)):
+        raise SystemExit("two migration scripts have the same version")
+    return migrations
+
+
+def splitBatches(sql):
+    return [batch for batch in batch_separator.split(sql) if batch.strip()]
+
+
+# returns the versions recorded in schemaVersions, the table is created first unless create is False
+def appliedVersions(cursor, create=True):
+    if cursor.execute("SELECT OBJECT_ID('dbo.schemaVersions')").fetchval() is None:
+        if not create:
+            return set()
+        cursor.execute(
+            """
+            CREATE TABLE [dbo].[schemaVersions](
+                [version] [int] NOT NULL CONSTRAINT [PK_schemaVersions] PRIMARY KEY CLUSTERED,
+                [name] [nvarchar](128) NOT NULL,
+                [appliedAt] [datetime] NOT NULL
+            )
+            """
+        )
+        cursor.commit()
+    return {row.version for row in cursor.execute("SELECT version FROM schemaVersions")}
+
+
+def recordVersion(cursor, version, name):
+    cursor.execute(
+        "INSERT INTO schemaVersions(version, name, appliedAt) VALUES (?, ?, GETUTCDATE())",
+        version,
+        name,
+    )
+
+
+def main():
+    args = sys.argv[1:]
+    dry_run = "--dry-run" in args
+    baseline = None
+    if "--baseline" in args:
+        try:
+            baseline = int(args[args.index("--baseline") + 1])
+        except (IndexError, ValueError):
+            raise SystemExit("--baseline needs a version")
+
+    cnxn = database.getConnection()
+    if cnxn is None:
+        raise SystemExit("Could not connect to database")
+    cursor = cnxn.cursor()
+
+    applied = appliedVersions(cursor, create=not dry_run)
+    pending = [m for m in listMigrations() if m[0] not in applied]
+    if len(pending) == 0:
+        print("Database is up to date")
+
+    for version, name, path in pending:
+        if baseline is not None and version <= baseline:
+            if dry_run:
+                print(f"Baseline V{version:03d} {name}")
+                continue
+            recordVersion(cursor, version, name)
+            cnxn.commit()
+            print(f"Marked V{version:03d} {name} as applied")
+            continue
+
+        if dry_run:
+            print(f"Pending V{version:03d} {name}")
+            continue
+
+        with open(path, encoding="utf-8-sig") as file:
+            batches = splitBatches(file.read())
+        try:
+            for batch in batches:
+                cursor.execute(batch)
+            recordVersion(cursor, version, name)
+            cnxn.commit()
+        except Exception:
+            cnxn.rollback()
+            print(f"Failed V{version:03d} {name}")
+            raise
+        print(f"Applied V{version:03d} {name}")
+
+    cursor.close()
+    database.releaseConnection(cnxn)
+
+
+if __name__ == "__main__":
+    main()
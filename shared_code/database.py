@@ -0,0 +1,370 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import pyodbc
+
+# Shared database helpers for the integration tables.
+# Connections are pooled at module scope so warm workers skip the TLS and login handshake to Azure SQL.
+
+db_url = os.environ["DB_URL"]
+db = os.environ["DB"]
+db_username = os.environ["DB_USERNAME"]
+db_password = os.environ["DB_PASSWORD"]
+db_driver = os.environ["DB_DRIVER"]
+connection_string = (
+    "DRIVER="
+    + db_driver
+    + ";SERVER="
+    + db_url
+    + ";PORT=1433;DATABASE="
+    + db
+    + ";UID="
+    + db_username
+    + ";PWD="
+    + db_password
+    + ";Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
+)
+# idle connections kept per worker
+pool_size = int(os.environ.get("DB_POOL_SIZE", "4"))
+# connections idle for longer than this are checked with SELECT 1 before they are reused
+pool_check_after = float(os.environ.get("DB_POOL_CHECK_AFTER_SECONDS", "30"))
+# connect attempts before giving up, waiting DB_CONNECT_BACKOFF_SECONDS, then twice as long, and so on
+connect_attempts = int(os.environ.get("DB_CONNECT_ATTEMPTS", "4"))
+connect_backoff = float(os.environ.get("DB_CONNECT_BACKOFF_SECONDS", "2"))
+
+# run before a connection goes back to the pool, .rowcount is -1 while NOCOUNT is on
+session_reset = "SET NOCOUNT OFF; SET XACT_ABORT OFF; SET TRANSACTION ISOLATION LEVEL READ COMMITTED;"
+
+idle_connections = []  # (connection, time released)
+pool_lock = threading.Lock()
+connect_stats = {
+    "connects": 0,
+    "reused": 0,
+    "failures": 0,
+    "lastConnectSeconds": 0.0,
+    "totalConnectSeconds": 0.0,
+}
+
+
+# returns a pooled connection, or a new one if none is idle, None if the database could not be reached
+def getConnection():
+    while True:
+        with pool_lock:
+            if len(idle_connections) == 0:
+                break
+            cnxn, released_at = idle_connections.pop()
+        if time.time() - released_at < pool_check_after or isHealthy(cnxn):
+            connect_stats["reused"] += 1
+            return cnxn
+        closeQuietly(cnxn)
+
+    for attempt in range(connect_attempts):
+        start = time.time()
+        try:
+            cnxn = pyodbc.connect(connection_string)
+        except pyodbc.Error as ex:
+            connect_stats["failures"] += 1
+            logging.info(f"Could not connect to database, attempt {attempt + 1}: {ex}")
+            if attempt + 1 < connect_attempts:
+                time.sleep(connect_backoff * 2**attempt)
+            continue
+
+        elapsed = time.time() - start
+        connect_stats["connects"] += 1
+        connect_stats["lastConnectSeconds"] = elapsed
+        connect_stats["totalConnectSeconds"] += elapsed
+        logging.info(
+            f"Connected to database in {elapsed:.3f}s, connects: {connect_stats['connects']}, reused: {connect_stats['reused']}, failures: {connect_stats['failures']}"
+        )
+        return cnxn
+
+    return None
+
+
+# returns cnxn to the pool, anything it did not commit is rolled back first and the session
+# options a function may have changed are reset so the next function gets a clean session
+def releaseConnection(cnxn):
+    try:
+        cnxn.rollback()
+        cursor = cnxn.cursor()
+        cursor.execute(session_reset)
+        cursor.close()
+    except pyodbc.Error:
+        closeQuietly(cnxn)
+        return
+
+    with pool_lock:
+        if len(idle_connections) < pool_size:
+            idle_connections.append((cnxn, time.time()))
+            return
+    closeQuietly(cnxn)
+
+
+def isHealthy(cnxn):
+    try:
+        cursor = cnxn.cursor()
+        cursor.execute("SELECT 1").fetchone()
+        cursor.close()
+        return True
+    except pyodbc.Error:
+        return False
+
+
+def closeQuietly(cnxn):
+    try:
+        cnxn.close()
+    except pyodbc.Error:
+        pass
+
+
+# Loads rows into a session temp table (#name) in one batched round trip.
+# The table is dropped and recreated on every call so it never holds rows from an earlier run.
+# columns is a list of (name, sql type) tuples in the same order as the values in each row.
+def stageRows(cursor, table, columns, rows):
+    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute(
+        f"CREATE TABLE {table}("
+        + ", ".join(f"{name} {type}" for name, type in columns)
+        + ")"
+    )
+    insertRows(cursor, table, [name for name, type in columns], rows)
+
+
+# Inserts rows into table in one batched round trip, names are the columns in the order of the values in each row.
+# Does not commit
+def insertRows(cursor, table, names, rows):
+    if len(rows) == 0:
+        return
+
+    params = ", ".join("?" for name in names)
+    cursor.fast_executemany = True
+    try:
+        cursor.executemany(
+            f"INSERT INTO {table}({', '.join(names)}) VALUES ({params})", rows
+        )
+    finally:
+        cursor.fast_executemany = False
+
+
+# Applies the per occurrence results of a JC call with one set-based UPDATE, every row is also taken off the send queue.
+# results is a list of (occurrenceId, status, error). Does not commit, returns the number of updated rows
+def writeOccurrenceStatus(cursor, results):
+    # the last result of an occurrenceId wins
+    latest = {}
+    for occurrenceId, status, error in results:
+        latest[occurrenceId] = (occurrenceId, status, (error or "")[:128])
+    if len(latest) == 0:
+        return 0
+
+    stageRows(
+        cursor,
+        "#occurrence_status",
+        [
+            ("occurrenceId", "nvarchar(50) NOT NULL PRIMARY KEY"),
+            ("status", "varchar(16) NOT NULL"),
+            ("error", "varchar(128) NOT NULL"),
+        ],
+        list(latest.values()),
+    )
+    return cursor.execute(
+        "UPDATE o SET send=0, status=s.status, error=s.error, updatedAt=? FROM occurrences o JOIN #occurrence_status s ON s.occurrenceId = o.occurrenceId",
+        time.strftime("%Y-%m-%d %H:%M:%S"),
+    ).rowcount
+
+
+# Applies the per volunteer results of JC link calls with one set-based UPDATE of their NOT_SENT registrations.
+# results is a list of (jcvarId, status, error). Does not commit, returns the number of updated rows
+def writeRegistrationStatus(cursor, results):
+    latest = {}
+    for jcvarId, status, error in results:
+        latest[jcvarId] = (jcvarId, status, error[:128] if error else None)
+    if len(latest) == 0:
+        return 0
+
+    stageRows(
+        cursor,
+        "#registration_status",
+        [
+            ("jcvarId", "nvarchar(128) NOT NULL PRIMARY KEY"),
+            ("status", "varchar(16) NOT NULL"),
+            ("error", "varchar(128) NULL"),
+        ],
+        list(latest.values()),
+    )
+    return cursor.execute(
+        "UPDATE r SET status=s.status, error=s.error, updatedAt=? FROM registrations r JOIN #registration_status s ON s.jcvarId = r.jcvarId WHERE r.status='NOT_SENT'",
+        time.strftime("%Y-%m-%d %H:%M:%S"),
+    ).rowcount
+
+
+# Applies the per pair results of a JC hours call with one set-based UPDATE.
+# results is a list of (occurrenceId, volunteerId, startDate, endDate, hours, status, error) holding the values
+# that were sent, a NOT_SENT row is only updated while it still has them, so hours that changed in the meantime
+# stay queued. Does not commit, returns the number of updated rows
+def writeServiceHourStatus(cursor, results):
+    latest = {}
+    for occurrenceId, volunteerId, startDate, endDate, hours, status, error in results:
+        latest[(occurrenceId, volunteerId)] = (
+            occurrenceId,
+            volunteerId,
+            startDate,
+            endDate,
+            hours,
+            status,
+            error[:128] if error else None,
+        )
+    if len(latest) == 0:
+        return 0
+
+    stageRows(
+        cursor,
+        "#service_hour_status",
+        [
+            ("occurrenceId", "nvarchar(50) NOT NULL"),
+            ("volunteerId", "nvarchar(128) NOT NULL"),
+            ("startDate", "datetime NOT NULL"),
+            ("endDate", "datetime NULL"),
+            ("hours", "numeric(20, 2) NOT NULL"),
+            ("status", "varchar(16) NOT NULL"),
+            ("error", "varchar(128) NULL"),
+        ],
+        list(latest.values()),
+    )
+    return cursor.execute(
+        """
+        UPDATE h SET status=s.status, error=s.error, updatedAt=?
+        FROM serviceHours h JOIN #service_hour_status s
+            ON s.occurrenceId = h.occurrenceId AND s.volunteerId = h.volunteerId
+            AND s.startDate = h.startDate
+            AND s.hours = h.hours
+            AND ISNULL(s.endDate, '19000101') = ISNULL(h.endDate, '19000101')
+        WHERE h.status='NOT_SENT'
+        """,
+        time.strftime("%Y-%m-%d %H:%M:%S"),
+    ).rowcount
+
+
+# Stores an outbound message envelope once for all of its serviceHours rows. Does not commit, returns its payloadId
+def saveServiceHourPayload(cursor, envelope):
+    return cursor.execute(
+        "INSERT INTO serviceHourPayloads(envelope, createdAt) OUTPUT INSERTED.payloadId VALUES (?, ?)",
+        envelope,
+        time.strftime("%Y-%m-%d %H:%M:%S"),
+    ).fetchval()
+
+
+# Upserts serviceHours rows in one batch by their natural key (occurrenceId, volunteerId).
+# New pairs are inserted NOT_SENT, stored pairs whose dates or hours changed are updated and queued to be sent
+# again, everything else (redelivered messages, replayed spool entries, re-saves without changes) is left alone.
+# rows is a list of (notificationId, occurrenceId, volunteerId, startDate, endDate, hours, modifiedAt, payloadId),
+# modifiedAt being the Salesforce SystemModstamp of the connection: the newest row of a pair wins and a stored
+# pair is only updated by a newer row, so a late redelivery of an older notification cannot overwrite it.
+# A newer re-save without changes only moves modifiedAt on. Without modifiedAt the last row wins.
+# Does not commit, returns the number of inserted or updated rows
+def writeServiceHours(cursor, rows):
+    latest = {}
+    for row in rows:
+        key = (row[1], row[2])
+        if key not in latest or not isOlder(row[6], latest[key][6]):
+            latest[key] = row
+    if len(latest) == 0:
+        return 0
+
+    # the Salesforce timestamps are staged as datetimes, not left for the driver to convert
+    staged = [
+        (
+            notificationId,
+            occurrenceId,
+            volunteerId,
+            toUTC(startDate),
+            toUTC(endDate),
+            hours,
+            toUTC(modifiedAt),
+            payloadId,
+        )
+        for (
+            notificationId,
+            occurrenceId,
+            volunteerId,
+            startDate,
+            endDate,
+            hours,
+            modifiedAt,
+            payloadId,
+        ) in latest.values()
+    ]
+
+    stageRows(
+        cursor,
+        "#service_hours",
+        [
+            ("notificationId", "nvarchar(18) NULL"),
+            ("occurrenceId", "nvarchar(50) NOT NULL"),
+            ("volunteerId", "nvarchar(128) NOT NULL"),
+            ("startDate", "datetime NOT NULL"),
+            ("endDate", "datetime NULL"),
+            ("hours", "numeric(20, 2) NOT NULL"),
+            ("modifiedAt", "datetime NULL"),
+            ("payloadId", "int NULL"),
+        ],
+        staged,
+    )
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    return cursor.execute(
+        """
+        MERGE serviceHours AS t
+        USING (
+            SELECT s.*, CASE WHEN h.occurrenceId IS NULL
+                OR h.startDate <> s.startDate
+                OR h.hours <> s.hours
+                OR ISNULL(h.endDate, '19000101') <> ISNULL(s.endDate, '19000101')
+                THEN 1 ELSE 0 END AS changed
+            FROM #service_hours s
+            LEFT JOIN serviceHours h ON h.occurrenceId = s.occurrenceId AND h.volunteerId = s.volunteerId
+            WHERE s.notificationId IS NULL OR NOT EXISTS (SELECT 1 FROM serviceHours n WHERE n.notificationId = s.notificationId)
+        ) AS s ON t.occurrenceId = s.occurrenceId AND t.volunteerId = s.volunteerId
+        WHEN MATCHED AND (
+            t.modifiedAt IS NULL OR s.modifiedAt IS NULL OR s.modifiedAt > t.modifiedAt
+        ) AND (
+            s.changed = 1 OR s.modifiedAt > ISNULL(t.modifiedAt, '19000101')
+        ) THEN UPDATE SET
+            startDate = s.startDate,
+            endDate = s.endDate,
+            hours = s.hours,
+            modifiedAt = ISNULL(s.modifiedAt, t.modifiedAt),
+            status = CASE WHEN s.changed = 1 THEN 'NOT_SENT' ELSE t.status END,
+            error = CASE WHEN s.changed = 1 THEN NULL ELSE t.error END,
+            updatedAt = ?,
+            payloadId = s.payloadId,
+            notificationId = s.notificationId
+        WHEN NOT MATCHED THEN
+            INSERT (occurrenceId, volunteerId, startDate, endDate, hours, modifiedAt, status, createdAt, payloadId, notificationId)
+            VALUES (s.occurrenceId, s.volunteerId, s.startDate, s.endDate, s.hours, s.modifiedAt, 'NOT_SENT', ?, s.payloadId, s.notificationId);
+        """,
+        now,
+        now,
+    ).rowcount
+
+
+# True if the Salesforce timestamp modified is older than other, False when either is missing
+def isOlder(modified, other):
+    if not modified or not other:
+        return False
+    return parseTimestamp(modified) < parseTimestamp(other)
+
+
+def parseTimestamp(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+# the naive UTC datetime of a Salesforce timestamp, as stored in the datetime columns, None if it is missing
+def toUTC(value):
+    if not value:
+        return None
+    parsed = parseTimestamp(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
@@ -0,0 +1,225 @@
+import csv
+import logging
+import os
+import requests
+from requests.adapters import HTTPAdapter
+import time
+import threading
+from collections import OrderedDict
+from itertools import islice
+
+from shared_code.mapping import mapJSONData
+
+# Shared HOHK SOLR access, the HOHK -> JC field mapping itself is in mapping.py.
+# Used in-process by cacheOccurrences and wrapped over HTTP by the jobmap and occurrence functions.
+
+hohk_api_url = os.environ["HOHK_API_URL"]
+hohk_api_username = os.environ["HOHK_API_USERNAME"]
+hohk_api_password = os.environ["HOHK_API_PASSWORD"]
+# shared so that concurrent batch requests reuse pooled connections to SOLR
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_maxsize=16))
+# only the fields read by the mapping
+select_fields = "occurrenceId,sponsoringOrganizationID,maximumAttendance,volunteersNeeded,voThumbnailUrl,voCreatedDate,title,description,detailUrl,ocCreatedDate,startDateTime,endDateTime,locationAddress,categoryTags,populationsServed,Language"
+# date fields that change whenever an occurrence or its opportunity is created or edited, used by delta syncs
+modified_fields = os.environ.get(
+    "HOHK_MODIFIED_FIELDS", "ocLastModifiedDate,voLastModifiedDate"
+).split(",")
+# occurrenceIds per jobmap page
+jobmap_page_size = int(os.environ.get("JOBMAP_PAGE_SIZE", "5000"))
+# SOLR docs per page, every occurrence has one doc per language
+solr_page_size = int(os.environ.get("SOLR_PAGE_SIZE", "200"))
+# sending it to SOLR with too many occurrenceIds (100+) seems to cause problems
+solr_ids_per_query = 100
+
+# mapped occurrences cached per worker, occurrenceId -> (expiry time, occurrence)
+occurrence_cache_ttl = int(os.environ.get("OCCURRENCE_CACHE_TTL", "300"))
+occurrence_cache_size = int(os.environ.get("OCCURRENCE_CACHE_SIZE", "5000"))
+occurrence_cache = OrderedDict()
+occurrence_cache_stats = {"hits": 0, "misses": 0}
+occurrence_cache_lock = threading.Lock()
+
+
+# Creates a list of valid occurrences as of today
+# with since (a UTC datetime), only occurrences created or modified from then on are returned
+def getActiveOccurrenceIds(since=None):
+    return list(iterActiveOccurrenceIds(since))
+
+
+# yields the active occurrenceIds page by page, each page is parsed from the CSV response as it arrives
+def iterActiveOccurrenceIds(since=None):
+    query = 'IsOccurrenceActive:true AND IsOrganizationServedActive:true AND IsOpportunityActive:true AND -invitationCode:* AND scheduleType:"Date & Time Specific"'
+
+    # Add criteria 1: At least 4 volunteer spots open
+    # query += " AND volunteersNeeded:[4 TO *]"
+
+    # Add criteria 2: Add occurences: now <= (occurence start date) <= 2 months from now
+    query += " AND endDateTime:[NOW TO NOW+2MONTHS]"
+
+    if since is not None:
+        since_text = since.strftime("%Y-%m-%dT%H:%M:%SZ")
+        # occurrences that entered the 2 month window since then are new to JC even if nobody edited them
+        query += (
+            " AND ("
+            + " OR ".join(
+                [f"{field}:[{since_text} TO *]" for field in modified_fields]
+                + [f"endDateTime:[{since_text}+2MONTHS TO NOW+2MONTHS]"]
+            )
+            + ")"
+        )
+
+    start = 0
+    params = {
+        "q": query,
+        # one row per occurrence, much cheaper than grouping with group.ngroups
+        "fq": "{!collapse field=occurrenceId}",
+        "fl": "occurrenceId",
+        "sort": "occurrenceId asc",
+        "wt": "csv",
+        "rows": jobmap_page_size,
+        # NOW is fixed for every page so the date range cannot shift while paging
+        "NOW": int(time.time() * 1000),
+    }
+    while True:
+        params["start"] = start
+        with session.get(
+            hohk_api_url,
+            params=params,
+            auth=(hohk_api_username, hohk_api_password),
+            stream=True,
+        ) as r:
+            r.raise_for_status()
+            r.encoding = r.encoding or "utf-8"
+            rows = csv.reader(r.iter_lines(decode_unicode=True))
+            next(rows, None)  # even if list is empty we will still get the header
+            count = 0
+            for row in rows:
+                if row:
+                    count += 1
+                    yield row[0]
+
+        start += count
+        if count < jobmap_page_size:
+            return
+
+
+# returns (occurrences in JC format, occurrenceIds not found in SOLR)
+def getOccurrences(occurrenceIds):
+    missing_ids = []
+    return_occurrences = list(iterOccurrences(occurrenceIds, missing_ids))
+
+    if len(missing_ids) > 0:
+        logging.info(f"No matches found for occurrences {','.join(missing_ids)}")
+
+    return (return_occurrences, missing_ids)
+
+
+# yields the occurrences in JC format in the requested order, only one batch of ids is held in memory at a time
+# occurrenceIds not found in SOLR are appended to missing_ids when it is given
+# with use_cache, occurrences mapped less than OCCURRENCE_CACHE_TTL seconds ago are not fetched again,
+# fetched occurrences always refresh the cache
+def iterOccurrences(occurrenceIds, missing_ids=None, use_cache=False):
+    for id_batch in batched(occurrenceIds, solr_ids_per_query):
+        cached = getCachedOccurrences(id_batch) if use_cache else {}
+        to_fetch = [id for id in id_batch if id not in cached]
+        grouped = groupByOccurrence(getOccurrenceDocs(to_fetch)) if to_fetch else {}
+        for id in id_batch:
+            if id in cached:
+                yield cached[id]
+            elif id in grouped:
+                occurrence = getObject(grouped[id])
+                cacheOccurrence(id, occurrence)
+                yield occurrence
+            elif missing_ids is not None:
+                missing_ids.append(id)
+
+
+# returns occurrenceId -> occurrence for the unexpired cache entries among occurrenceIds
+def getCachedOccurrences(occurrenceIds):
+    now = time.time()
+    cached = {}
+    with occurrence_cache_lock:
+        for id in occurrenceIds:
+            entry = occurrence_cache.get(id)
+            if entry is not None and entry[0] > now:
+                occurrence_cache.move_to_end(id)
+                cached[id] = entry[1]
+                occurrence_cache_stats["hits"] += 1
+            else:
+                occurrence_cache_stats["misses"] += 1
+    return cached
+
+
+def cacheOccurrence(occurrenceId, occurrence):
+    with occurrence_cache_lock:
+        occurrence_cache[occurrenceId] = (
+            time.time() + occurrence_cache_ttl,
+            occurrence,
+        )
+        occurrence_cache.move_to_end(occurrenceId)
+        while len(occurrence_cache) > occurrence_cache_size:
+            occurrence_cache.popitem(last=False)
+
+
+# yields the SOLR docs of every language variant of occurrenceIds, paging until numFound is reached
+def getOccurrenceDocs(occurrenceIds):
+    start = 0
+    while True:
+        params = {
+            # (occurenceId1 occurenceId2) the parenthesis allows for SQL IN style query
+            "q": f"occurrenceId:({' '.join(occurrenceIds)})",
+            "wt": "json",
+            "fl": select_fields,
+            "sort": "occurrenceId asc",
+            "start": start,
+            "rows": solr_page_size,
+        }
+        r = session.get(
+            hohk_api_url, params=params, auth=(hohk_api_username, hohk_api_password)
+        )
+        r.raise_for_status()
+        json_response = r.json()["response"]
+        docs = json_response["docs"]
+        yield from docs
+
+        start += len(docs)
+        if len(docs) == 0 or start >= json_response["numFound"]:
+            logging.info(
+                f"Found {json_response['numFound']} results for {len(occurrenceIds)} occurrences."
+            )
+            return
+
+
+# indexes SOLR docs in a single pass as occurrenceId -> {Language: doc}
+def groupByOccurrence(docs):
+    grouped = {}
+    for d in docs:
+        grouped.setdefault(d.get("occurrenceId"), {})[d.get("Language")] = d
+    return grouped
+
+
+# languages is the {Language: doc} map of a single occurrence
+def getObject(languages):
+    # Map the fields to VMS format
+    eng_dict = languages.get("English")
+
+    # JC only has en and zh, any other variant is treated as Chinese but an explicit Chinese one wins
+    chi_dict = None
+    for language, d in languages.items():
+        if language == "English":
+            continue
+        if chi_dict is None or (language or "").startswith("Chinese"):
+            chi_dict = d
+
+    dict = mapJSONData(eng_dict, chi_dict)
+    return dict
+
+
+def batched(iterable, n):
+    "Batch data into lists of length n. The last batch may be shorter."
+    # batched('ABCDEFG', 3) --> ABC DEF G
+    if n < 1:
+        raise ValueError("n must be at least one")
+    it = iter(iterable)
+    while batch := list(islice(it, n)):
+        yield batch
@@ -0,0 +1,267 @@
+import base64
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import requests
+from PIL import Image, ImageOps
+from requests.adapters import HTTPAdapter
+
+from shared_code import database
+
+# Persistent cache of the thumbnails sent to JC, kept in the imageCache table and keyed by URL.
+# Every source image is cropped to the JC aspect ratios, scaled down and re-encoded as JPEG once,
+# the cache holds the base64 results together with the parameters they were made with.
+# Entries fetched less than IMAGE_CACHE_MAX_AGE_HOURS ago are used as is, older ones are revalidated
+# with a conditional GET so that unchanged images are not downloaded again.
+
+image_cache_max_age = timedelta(
+    hours=int(os.environ.get("IMAGE_CACHE_MAX_AGE_HOURS", "24"))
+)
+# entries not used by a run for this long are evicted
+image_cache_max_idle = timedelta(
+    days=int(os.environ.get("IMAGE_CACHE_MAX_IDLE_DAYS", "30"))
+)
+# least recently used entries are evicted beyond this total size of encoded images
+image_cache_max_bytes = int(
+    os.environ.get("IMAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+# appImage is 4:3 and webImage 16:9, larger images are scaled down to these sizes, smaller ones are only cropped
+image_app_size = tuple(
+    int(n) for n in os.environ.get("IMAGE_APP_SIZE", "800x600").split("x")
+)
+image_web_size = tuple(
+    int(n) for n in os.environ.get("IMAGE_WEB_SIZE", "1280x720").split("x")
+)
+image_quality = int(os.environ.get("IMAGE_QUALITY", "80"))
+# cached entries made with other parameters are downloaded and encoded again
+image_params = f"app={image_app_size[0]}x{image_app_size[1]};web={image_web_size[0]}x{image_web_size[1]};q={image_quality}"
+# shared by the concurrent prefetch in batchOccurrences
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_maxsize=16))
+session.mount("http://", HTTPAdapter(pool_maxsize=16))
+stats_lock = threading.Lock()
+
+
+def newStats():
+    return {
+        "hits": 0,
+        "revalidated": 0,
+        "misses": 0,
+        "errors": 0,
+        "originalBytes": 0,
+        "sentBytes": 0,
+    }
+
+
+# getImage runs on several threads at once
+def count(stats, key, n=1):
+    with stats_lock:
+        stats[key] += n
+
+
+def urlHash(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+# length of the base64 string of n bytes
+def base64Length(n):
+    return 4 * ((n + 2) // 3)
+
+
+# returns url -> entry for the images among urls that are in the cache
+def loadCachedImages(cursor, urls):
+    database.stageRows(
+        cursor,
+        "#image_urls",
+        [("urlHash", "char(64) NOT NULL PRIMARY KEY")],
+        [(urlHash(url),) for url in set(urls) if url],
+    )
+    rows = cursor.execute(
+        "SELECT i.url, i.etag, i.lastModified, i.params, i.appB64, i.webB64, i.bytes, i.fetchedAt FROM imageCache i JOIN #image_urls u ON u.urlHash = i.urlHash"
+    ).fetchall()
+    return {
+        row.url: {
+            "url": row.url,
+            "etag": row.etag,
+            "lastModified": row.lastModified,
+            "params": row.params,
+            "appB64": row.appB64,
+            "webB64": row.webB64,
+            "bytes": row.bytes,
+            "fetchedAt": row.fetchedAt,
+            "changed": False,
+        }
+        for row in rows
+    }
+
+
+# Safe to call from several threads, it does not touch the database.
+# returns the entry for url, only downloading when the cached entry is missing or stale and has changed
+# raises requests.RequestException if the image cannot be fetched
+def getImage(url, cached, stats):
+    if cached is not None and cached["params"] != image_params:
+        cached = None
+
+    now = datetime.utcnow()
+    if cached is not None and now - cached["fetchedAt"] < image_cache_max_age:
+        count(stats, "hits")
+        return cached
+
+    headers = {}
+    if cached is not None and cached["etag"]:
+        headers["If-None-Match"] = cached["etag"]
+    if cached is not None and cached["lastModified"]:
+        headers["If-Modified-Since"] = cached["lastModified"]
+
+    r = session.get(url, headers=headers, timeout=30)
+    if r.status_code == 304 and cached is not None:
+        count(stats, "revalidated")
+        # the stored images are kept, only the validators and fetchedAt are written back
+        return dict(
+            cached,
+            etag=r.headers.get("ETag", cached["etag"]),
+            lastModified=r.headers.get("Last-Modified", cached["lastModified"]),
+            fetchedAt=now,
+            changed=False,
+        )
+
+    r.raise_for_status()
+    count(stats, "misses")
+    app_b64, web_b64 = normalizeImage(url, r.content)
+    return {
+        "url": url,
+        "etag": r.headers.get("ETag"),
+        "lastModified": r.headers.get("Last-Modified"),
+        "params": image_params,
+        "appB64": app_b64,
+        "webB64": web_b64,
+        "bytes": len(r.content),
+        "fetchedAt": now,
+        "changed": True,
+    }
+
+
+# returns the (appImage, webImage) base64 strings for the image bytes in content
+# images Pillow cannot read are sent unchanged as both
+def normalizeImage(url, content):
+    try:
+        image = Image.open(BytesIO(content))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+    except (OSError, Image.DecompressionBombError) as err:
+        logging.info(f"Image {url} is sent unchanged: {err}")
+        b64 = base64.b64encode(content).decode("utf-8")
+        return (b64, b64)
+
+    return (
+        encodeJPEG(cropToSize(image, image_app_size)),
+        encodeJPEG(cropToSize(image, image_web_size)),
+    )
+
+
+# crops the centre of image to the aspect ratio of size and scales it down to size if it is larger
+def cropToSize(image, size):
+    width, height = size
+    src_width, src_height = image.size
+    if src_width * height > src_height * width:
+        crop_width = round(src_height * width / height)
+        left = (src_width - crop_width) // 2
+        image = image.crop((left, 0, left + crop_width, src_height))
+    else:
+        crop_height = round(src_width * height / width)
+        top = (src_height - crop_height) // 2
+        image = image.crop((0, top, src_width, top + crop_height))
+
+    if image.width > width:
+        image = image.resize((width, height), Image.LANCZOS)
+    return image
+
+
+def encodeJPEG(image):
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=image_quality, optimize=True)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+# Writes downloaded and revalidated entries back and marks every entry as used. Does not commit
+def saveCachedImages(cursor, entries):
+    database.stageRows(
+        cursor,
+        "#image_cache_staging",
+        [
+            ("urlHash", "char(64) NOT NULL PRIMARY KEY"),
+            ("url", "nvarchar(2048) NOT NULL"),
+            ("etag", "nvarchar(256) NULL"),
+            ("lastModified", "nvarchar(64) NULL"),
+            ("params", "varchar(64) NOT NULL"),
+            ("appB64", "varchar(max) NULL"),
+            ("webB64", "varchar(max) NULL"),
+            ("bytes", "int NOT NULL"),
+            ("fetchedAt", "datetime NOT NULL"),
+        ],
+        [
+            (
+                urlHash(entry["url"]),
+                entry["url"],
+                entry["etag"],
+                entry["lastModified"],
+                entry["params"],
+                # unchanged images are not sent back to the database
+                entry["appB64"] if entry["changed"] else None,
+                entry["webB64"] if entry["changed"] else None,
+                entry["bytes"],
+                entry["fetchedAt"],
+            )
+            for entry in entries
+        ],
+    )
+    cursor.execute(
+        """
+        MERGE imageCache AS t
+        USING #image_cache_staging AS s ON t.urlHash = s.urlHash
+        WHEN MATCHED THEN UPDATE SET
+            etag = s.etag,
+            lastModified = s.lastModified,
+            params = s.params,
+            appB64 = COALESCE(s.appB64, t.appB64),
+            webB64 = COALESCE(s.webB64, t.webB64),
+            bytes = s.bytes,
+            fetchedAt = s.fetchedAt,
+            usedAt = ?
+        WHEN NOT MATCHED AND s.appB64 IS NOT NULL THEN
+            INSERT (urlHash, url, etag, lastModified, params, appB64, webB64, bytes, fetchedAt, usedAt)
+            VALUES (s.urlHash, s.url, s.etag, s.lastModified, s.params, s.appB64, s.webB64, s.bytes, s.fetchedAt, ?);
+        """,
+        datetime.utcnow(),
+        datetime.utcnow(),
+    )
+
+
+# Evicts entries idle for longer than IMAGE_CACHE_MAX_IDLE_DAYS, then the least recently used ones
+# beyond IMAGE_CACHE_MAX_BYTES. Does not commit, returns the number of evicted entries
+def evictCachedImages(cursor):
+    evicted = cursor.execute(
+        "DELETE FROM imageCache WHERE usedAt < ?",
+        datetime.utcnow() - image_cache_max_idle,
+    ).rowcount
+    evicted += cursor.execute(
+        """
+        WITH ranked AS (
+            SELECT urlHash, SUM(CAST(DATALENGTH(appB64) + DATALENGTH(webB64) AS bigint)) OVER (ORDER BY usedAt DESC, urlHash ROWS UNBOUNDED PRECEDING) AS total
+            FROM imageCache
+        )
+        DELETE FROM imageCache WHERE urlHash IN (SELECT urlHash FROM ranked WHERE total > ?)
+        """,
+        image_cache_max_bytes,
+    ).rowcount
+    return evicted
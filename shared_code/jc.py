@@ -0,0 +1,146 @@
+import base64
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared JC API client. The access token is cached per worker until shortly before it expires
+# and all calls go through one pooled session, so a warm function neither logs in again nor
+# opens a new TLS connection for every request.
+# Calls return the requests.Response (None if no access token could be obtained),
+# what a status code means for the caller's rows is left to the functions.
+
+jc_api_url = os.environ["JC_API_URL"]
+jc_api_username = os.environ["JC_API_USERNAME"]
+jc_api_login_path = os.environ["JC_API_LOGIN_PATH"]
+# the paths are only read by the calls that use them, not every function is configured with all of them
+jc_api_paths = {
+    "upsert": "JC_API_UPSERT_PATH",
+    "unlist": "JC_API_UNLIST_PATH",
+    "hours": "JC_API_HOURS_PATH",
+    "link": "JC_API_VOLUNTEER_LINK_PATH",
+    "linkage": "JC_API_VOLUNTEER_LINKAGE_PATH",
+}
+# used when the login response does not say when the token expires
+token_ttl = int(os.environ.get("JC_TOKEN_TTL_SECONDS", "3600"))
+# the token is refreshed this long before it expires
+token_refresh_margin = int(os.environ.get("JC_TOKEN_REFRESH_MARGIN_SECONDS", "60"))
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_maxsize=16))
+token = {"accessToken": None, "expiresAt": 0.0}
+token_lock = threading.Lock()
+
+
+def url(name):
+    return f"https://{jc_api_url}/{os.environ[jc_api_paths[name]]}"
+
+
+# returns the cached access token, logging in again when it is missing, about to expire or refresh is set
+# returns None if JC refused the login or could not be reached
+def getAccessToken(refresh=False):
+    with token_lock:
+        if (
+            not refresh
+            and token["accessToken"] is not None
+            and time.time() < token["expiresAt"] - token_refresh_margin
+        ):
+            return token["accessToken"]
+
+        retries = 1
+        while retries < 3:
+            try:
+                r = session.post(
+                    f"https://{jc_api_url}/{jc_api_login_path}",
+                    json={"email": jc_api_username},
+                    timeout=30,
+                )
+            except requests.RequestException as err:
+                # kept apart from the errors of the calls, a login timeout says nothing about their payload
+                logging.info(f"Could not log in to JC: {err}")
+                r = None
+            if r is not None and r.status_code == 200:
+                body = r.json()
+                token["accessToken"] = body.get("accessToken")
+                token["expiresAt"] = tokenExpiry(body)
+                return token["accessToken"]
+            else:
+                wait = retries * 3
+                time.sleep(wait)
+                retries += 1
+
+        token["accessToken"] = None
+        return None
+
+
+# the expiry time of the token in the login response body: expiresIn if given, else the exp claim of the JWT
+def tokenExpiry(body):
+    if body.get("expiresIn"):
+        return time.time() + float(body.get("expiresIn"))
+    try:
+        payload = body.get("accessToken").split(".")[1]
+        claims = json.loads(
+            base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        )
+        return float(claims["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return time.time() + token_ttl
+
+
+# sends an authorised request, logging in again once if JC answers 401
+# returns None if no access token could be obtained, raises requests.RequestException (e.g. requests.Timeout)
+# like session.request for the request itself
+def call(method, name, **kwargs):
+    accessToken = getAccessToken()
+    if accessToken is None:
+        return None
+
+    r = session.request(
+        method, url(name), headers={"Authorization": "Bearer " + accessToken}, **kwargs
+    )
+    if r.status_code == 401:
+        logging.info("JC access token was rejected, logging in again")
+        accessToken = getAccessToken(refresh=True)
+        if accessToken is None:
+            return None
+        r = session.request(
+            method,
+            url(name),
+            headers={"Authorization": "Bearer " + accessToken},
+            **kwargs,
+        )
+    return r
+
+
+# occurrences: list of JC volunteer opportunities
+def upsert(occurrences, timeout=None):
+    return call("POST", "upsert", json=occurrences, timeout=timeout)
+
+
+# occurrenceIds: list of occurrenceIds to unlist
+def unlist(occurrenceIds):
+    return call(
+        "POST",
+        "unlist",
+        json=[{"vmpJobId": id, "visibility": "unlisted"} for id in occurrenceIds],
+        timeout=60,
+    )
+
+
+# records: list of service hours (vmpJobId, varUserId, startDateTime, endDateTime, hour)
+def hours(records):
+    return call("POST", "hours", json=records, timeout=120)
+
+
+def link(userId, isLink=True):
+    return call(
+        "POST", "link", json={"varUserId": userId, "isLink": isLink}, timeout=30
+    )
+
+
+def linkage(userId):
+    return call("GET", "linkage", params={"varUserId": userId}, timeout=30)
@@ -0,0 +1,333 @@
+import logging
+from datetime import datetime, timedelta
+from functools import lru_cache
+import pytz
+
+# Declarative HOHK (SOLR) -> JC occurrence mapping.
+# occurrence_spec describes every JC field and is compiled once at import into mapJSONData.
+#
+# Supported entry kinds:
+#   ("const", value)                                    same value for every occurrence
+#   ("field", hohk_field[, transform])                  value of the primary language doc
+#   ("date", hohk_field, transform)                     date string of the primary language doc
+#   ("localized", hohk_field, defaults[, transform])    {"en": ..., "zh": ...}, None for a missing language,
+#                                                       defaults is None when the field is required
+#   ("schedule", start_field, end_field, location_field, headers)
+#                                                       localized schedule text in Hong Kong time
+#   ("lookup", hohk_field, table, label)                list translated through table, unmapped values are
+#                                                       logged, the JC field is left out if hohk_field is missing
+#   ("computed", function)                              function(primary_dict, docs)
+#
+# docs is always (("en", json_dict_eng), ("zh", json_dict_chi)).
+
+hong_kong = pytz.timezone("Asia/Hong_Kong")
+omitted = object()
+
+
+@lru_cache(maxsize=4096)
+def parseDate(value):
+    # SOLR dates are UTC with a trailing Z, fromisoformat is several times faster than strptime
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z")
+
+
+def toJCDate(value):
+    return value.replace("Z", ".000Z")
+
+
+@lru_cache(maxsize=4096)
+def dayBefore(value):
+    return toJCDate(
+        (parseDate(value) + timedelta(days=-1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    )
+
+
+@lru_cache(maxsize=4096)
+def toHongKongTime(value):
+    return parseDate(value).astimezone(hong_kong).strftime("%a, %d %B %Y %I:%M%p")
+
+
+# The organiser ID has extra AAA characters at the end compared to the spreadsheet submitted by HOHK
+def trimOrganiserId(value):
+    return value[:-3] if len(value) == 18 else value
+
+
+def isFull(primary_dict, docs):
+    return (primary_dict["maximumAttendance"] - primary_dict["volunteersNeeded"]) <= 0
+
+
+def mapDocLocation(primary_dict, docs):
+    addresses = [
+        d.get("locationAddress", "").strip() if d is not None else ""
+        for language, d in docs
+    ]
+    return mapLocation(*addresses)
+
+
+# key is hohk side (categorytags), value (causes) is JC side
+causes_mapping = {
+    "Animal Welfare": "ANIMAL_WELFARE",
+    "Arts & Culture": "ARTS_CULTURE",
+    "Civic & Community": "COMMUNITY_DEVELOPMENT",
+    "Maintenance and renovation": "COMMUNITY_DEVELOPMENT",
+    "Disaster and emergency": "CRISIS_SUPPORT",
+    "Diversity and inclusion": "DIVERSITY_INCLUSION",
+    "Training and Empowerment": "EDUCATION",
+    "Education": "EDUCATION",
+    "Environmental Conservation": "ENVIRONMENT",
+    "Health and well-being": "HEALTH_SPORTS",
+    "Food Assistance": "POVERTY",
+    "Awareness and sharing information": "OTHERS",
+    "Support and assistance": "OTHERS",
+    "Waste Reduction": "ENVIRONMENT",
+    "Health & Wellness": "HEALTH_SPORTS",
+    "Health and Wellness": "HEALTH_SPORTS",
+    "Hygiene": "HEALTH_SPORTS",
+    "Hunger & Homelessness": "POVERTY",
+    "Education (new)": "EDUCATION",
+    "Assistance and Support for Elderly": "ELDERLY",
+}
+
+
+# key is hohk side (populationsServed), value (recipients) is JC side
+recipients_mapping = {
+    "Animals": "ANIMAL",
+    "Children and youth": "CHILDREN_YOUTH",
+    "Disadvantaged women": "WOMEN",
+    "Domestic & migrant workers": "FOREIGN_WORKERS",
+    "Elderly": "ELDERLY",
+    "Environment": "ENVIRONMENT",
+    "Ethnic minorities": "ETHNIC_MINORITY",
+    "Families": "FAMILIES",
+    "LGBTQ": "LGBT",
+    "Low income households": "LOW_INCOME",
+    "People experiencing homelessness": "LOW_INCOME",
+    "People with health conditions": "PATIENTS",
+    "People with mental health conditions": "MENTAL_HEALTH",
+    "People with physical disabilities": "DISABLED",
+    "People with special educational needs": "CHILDREN_YOUTH",
+    "Refugees and asylum seekers": "REFUGEES_ASYLUM",
+    "Adults": "GENERAL_PUBLIC",
+    "Environmental education": "ENVIRONMENT",
+    "Hunger & homelessness": "LOW_INCOME",
+}
+
+
+location_mapping = {
+    "Jordan Valley St. Joseph\u2019s Catholic Primary School, 80 Choi Ha Road, Kowloon Bay": "KWUN_TONG",
+    "Tung Chung Catholic Primary School, 8 Yat Tung St, Yau Tung Estate, Tung Chung": "ISLANDS",
+    "Nim Shue Wan Nim Shue Wan, Discovery Bay  Hong Kong": "ISLANDS",
+    "Room 3B, 3/F, Splendid Centre, 100 Larch Street, Tai Kok Tsui, Kowloon": "YAU_TSIM_MONG",
+    "outside Tsim Sha Tsui Marriage Registry, 10 Salisbury Rd, Tsim Sha Tsui": "YAU_TSIM_MONG",
+    "Impact Hong Kong Guest Room, 29 Oak St, Tai Kok Tsui": "YAU_TSIM_MONG",
+    "12/F, MONGKOK CHRISTIAN CENTRE, 56 BUTE STREET, MONGKOK KOWLOON  Hong Kong": "YAU_TSIM_MONG",
+    "Unit B, 14/F, Koon Wo Industrial Building, 63-75 Ta Chuen Ping Street, Kwai Chung": "KWAI_TSING",
+    "In-office Hong Kong Hong Kong": "HONG_KONG",
+    "International Christian Life Centre, Flat B, 1/F, Ngun Hoi Mansion, 163 Hai Tan Street, Sham Shui Po": "SHAM_SHUI_PO",
+    "Unit 2D, Worldwide Centre 123 Tung Chau Street, Tai Kok Tsui": "YAU_TSIM_MONG",
+    "Kowloon & Hong Kong Island": "HONG_KONG",
+    "Tseung Kwan O & Hang Hau": "SAI_KUNG",
+    "4/F, 64 Tsun Yip Street, South Asia Commercial Centre, Kwun Tong": "KWUN_TONG",
+    "Ground Floor, Un Lok House, Un Chau Estate, Shamshuipo, Kowloon, Hong Kong.": "SHAM_SHUI_PO",
+    "51 Pitt Street, Mong Kok": "YAU_TSIM_MONG",
+    "Kwun Tong Public Pier": "KWUN_TONG",
+    "outside Tsim Sha Tsui Marriage Registry, 10 Salisbury Rd, Tsim Sha Tsui": "YAU_TSIM_MONG",
+    "Shek Yam East Estate, Kwai Chung": "KWAI_TSING",
+    "8/F, Two Exchange Square, 8 Connaught Place, Central, Hong Kong": "CENTRAL_AND_WESTERN",
+    "Any recycling drop-off points": "HONG_KONG",
+    "301,Tung Sing House, Lei Tung Estate": "SOUTHERN",
+    "Lei Tung Estate near Lei Tung MTR exit B": "SOUTHERN",
+    "Cheung Sha Wan": "SHAM_SHUI_PO",
+    "Kwai Chung": "KWAI_TSING",
+    "Sai Ying Pun": "CENTRAL_AND_WESTERN",
+    "Tseung Kwan O": "SAI_KUNG",
+    "Quarry Bay": "EASTERN",
+    "Eaton Hong Kong, 380 Nathan Road, near hotel parking lot": "YAU_TSIM_MONG",
+    "Tsim Sha Tsui area": "YAU_TSIM_MONG",
+    "17/F, Block E, Chungking Mansions, 36-44 Nathan Road, Tsim Sha Tsui": "YAU_TSIM_MONG",
+    "To be determined Kowloon Hong Kong Hong Kong": "HONG_KONG",
+    "Aberdeen Sports Ground, 108 Wong Chuk Hang Road, Aberdeen": "SOUTHERN",
+    "Virtual Volunteering": "ONLINE",
+    "HHCKLA Buddhist Wong Cho Sum Primary School, 38 Po Lam Road N, King Lam Estate, Tseung Kwan O": "SAI_KUNG",
+    "Shop 22, G/F, Hoi Lai Shopping Centre, Sham Shui Po": "SHAM_SHUI_PO",
+    "Room 606, 6/F, 299QRC Nos, 287-299 Queen\u2019s Road Central, Central": "CENTRAL_AND_WESTERN",
+    "Hong Kong Southern District": "SOUTHERN",
+    "DIY Project": "HONG_KONG",
+    "G/F, Fung Sing Building, 235 Hai Tan Street, Sham Shui Po, Kowloon": "SHAM_SHUI_PO",
+    "HandsOn Hong Kong Office, Lai Chi Kok": "SHAM_SHUI_PO",
+    "Farend of Butterfly Beach, Tuen Mun": "TUEN_MUN",
+    "1/F, Car Park Building, Harmony Garden, Siu Sai Wan": "EASTERN",
+    "Hong Kong Wetland Park, Wetland Park Road, Tin Shui Wai": "YUEN_LONG",
+    "G/F, Tung Lam Court, Hing Tung Estate, Shau Kei Wan": "EASTERN",
+    "Cheung Sha Wan or Wong Tai Sin": "HONG_KONG",
+    "Tin Hau MTR station Exit A2": "WAN_CHAI",
+    "Central Pier No.3": "CENTRAL_AND_WESTERN",
+    "Morrison Hill Road Public Toilet": "WAN_CHAI",
+    "Wanchai MTR station Exit B2": "WAN_CHAI",
+    "Outside Fortress Hill MTR Exit A, in front of Wellcome supermarket": "EASTERN",
+    "19/F Berkshire House, Taikoo": "EASTERN",
+    "Bradbury Child Care Centre, 3/F, Holy Trinity Church Centenary Bradbury Building, 135 Ma Tau Chung Road, Ma Tau Wai": "KOWLOON_CITY",
+    "Room 606, 6/F, 299QRC Nos, 287-299 Queen's Road Central, Central": "CENTRAL_AND_WESTERN",
+    "Online via Zoom": "ONLINE",
+    "Block A2, Yau Tong Industrial City, 17-25 Ko Fai Road,Yau Tong": "KWUN_TONG",
+    "Chuan Kei Factory Building, 15-23 Kin Hong Street, Kwai Chung": "KWAI_TSING",
+    "SAHK Jockey Club Elaine Field School (Boarding), 1 Fu Chung Lane, Tai Po, New Territories": "TAI_PO",
+    "Hong Kong Golden Beach, So Kwun Wat (Tuen Mun)": "TUEN_MUN",
+    "Phase 1, Long Ping Estate, Yuen Long, N.T Hong Kong Hong Kong": "YUEN_LONG",
+    "Mei Wan Street, Tsuen Wan": "TSUEN_WAN",
+    "Unit L & K, 1FL, WAI CHEUNG INDUSTRIAL CENTRE, 5 SHEK PAI TAU ROAD, Tuen Mun, HK": "TUEN_MUN",
+}
+
+
+# can actually have multiple districts, but just treat that as Hong Kong or Kowloon
+def mapLocation(locationAddressEn, locationAddressZh):
+    new_list = []
+    if (
+        locationAddressEn not in location_mapping
+        and locationAddressZh not in location_mapping
+    ):
+        logging.info(
+            f"Location '{locationAddressEn}' and '{locationAddressZh}' have no mapping"
+        )
+        new_list.append("HONG_KONG")
+    elif locationAddressEn in location_mapping:
+        new_list.append(location_mapping[locationAddressEn])
+    elif locationAddressZh in location_mapping:
+        new_list.append(location_mapping[locationAddressZh])
+
+    return new_list
+
+
+occurrence_spec = {
+    "vmpJobId": ("field", "occurrenceId"),
+    "organiserId": ("field", "sponsoringOrganizationID", trimOrganiserId),
+    "visibility": ("const", "public"),
+    "isFull": ("computed", isFull),
+    "publishedAt": ("date", "voCreatedDate", toJCDate),
+    "name": ("localized", "title", None),
+    "description": (
+        "localized",
+        "description",
+        {
+            "en": "Please visit HandsOn Hong Kong to find out more.",
+            "zh": "請瀏覽到HandsOn Hong Kong 網站了解更多。",
+        },
+        str.strip,
+    ),
+    "appImage": ("field", "voThumbnailUrl"),  # Base64 image string 4:3
+    "webImage": ("field", "voThumbnailUrl"),  # supposed to be 16:9
+    "url": ("field", "detailUrl"),
+    "applicationStart": ("date", "ocCreatedDate", toJCDate),
+    "applicationEnd": ("date", "endDateTime", dayBefore),
+    "serviceStart": ("date", "startDateTime", toJCDate),
+    "serviceEnd": ("date", "endDateTime", toJCDate),
+    "schedules": (
+        "schedule",
+        "startDateTime",
+        "endDateTime",
+        "locationAddress",
+        {"en": "Volunteer Service", "zh": "義工服務"},
+    ),
+    "quota": ("field", "maximumAttendance"),
+    "locations": ("computed", mapDocLocation),
+    "causes": ("lookup", "categoryTags", causes_mapping, "Cause"),
+    "recipients": ("lookup", "populationsServed", recipients_mapping, "Recipient"),
+    # "additionalInfo": locationLatitude / locationLongitude from Nlatitude / Nlongitude
+}
+
+
+def compileSpec(spec):
+    steps = tuple((name, compileEntry(entry)) for name, entry in spec.items())
+
+    # pass in None if that language doesn't exist
+    def transform(json_dict_eng, json_dict_chi):
+        primary_dict = json_dict_eng if json_dict_eng is not None else json_dict_chi
+        docs = (("en", json_dict_eng), ("zh", json_dict_chi))
+        json_dict = {}
+        for name, step in steps:
+            value = step(primary_dict, docs)
+            if value is not omitted:
+                json_dict[name] = value
+        return json_dict
+
+    return transform
+
+
+def compileEntry(entry):
+    kind = entry[0]
+
+    if kind == "const":
+        value = entry[1]
+        return lambda primary_dict, docs: value
+
+    if kind == "field" or kind == "date":
+        field = entry[1]
+        transform = entry[2] if len(entry) > 2 else None
+        if transform is None:
+            return lambda primary_dict, docs: primary_dict[field]
+        return lambda primary_dict, docs: transform(primary_dict[field])
+
+    if kind == "localized":
+        field = entry[1]
+        defaults = entry[2]
+        transform = entry[3] if len(entry) > 3 else None
+
+        def localized(primary_dict, docs):
+            value = {}
+            for language, d in docs:
+                if d is None:
+                    value[language] = None
+                    continue
+                v = d[field] if defaults is None else d.get(field, defaults[language])
+                value[language] = v if transform is None else transform(v)
+            return value
+
+        return localized
+
+    if kind == "schedule":
+        start_field, end_field, location_field, headers = entry[1:]
+
+        def schedule(primary_dict, docs):
+            # formatted once and shared by every language
+            start = toHongKongTime(primary_dict[start_field])
+            end = toHongKongTime(primary_dict[end_field])
+            return {
+                language: (
+                    None
+                    if d is None
+                    else ("\n").join(
+                        [headers[language], start, end, d.get(location_field, "")]
+                    )
+                )
+                for language, d in docs
+            }
+
+        return schedule
+
+    if kind == "lookup":
+        field, table, label = entry[1:]
+        return lambda primary_dict, docs: (
+            mapList(primary_dict[field], table, label)
+            if field in primary_dict
+            else omitted
+        )
+
+    if kind == "computed":
+        return entry[1]
+
+    raise ValueError(f"Unknown mapping kind '{kind}'")
+
+
+def mapList(json_list, table, label):
+    new_list = []
+    for value in json_list:
+        if value not in table:
+            logging.info(f"{label} '{value}' has no mapping")
+        else:
+            new_list.append(table[value])
+    return new_list
+
+
+mapJSONData = compileSpec(occurrence_spec)
@@ -0,0 +1,52 @@
+from xml.etree.ElementTree import XMLPullParser
+
+# Streaming reader of Salesforce outbound message (SOAP) envelopes.
+# Only the requested sObject fields are kept, every Notification is dropped from the tree once
+# it has been yielded, so memory does not grow with the size of the envelope.
+
+# bytes of the body fed to the parser at a time
+feed_size = 16 * 1024
+
+
+def localName(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+# yields a dict per Notification in body (the raw envelope bytes) holding its Id as "notificationId" and
+# the text of the sObject fields named in fields (without the sf: prefix), None for missing or nil fields
+# raises xml.etree.ElementTree.ParseError if body is not well-formed
+def iterNotifications(body, fields):
+    fields = set(fields)
+    parser = XMLPullParser(events=("start", "end"))
+    notifications = None
+    notification = None
+    in_sobject = False
+
+    for offset in range(0, len(body), feed_size):
+        parser.feed(body[offset : offset + feed_size])
+        for event, element in parser.read_events():
+            name = localName(element.tag)
+            if event == "start":
+                if name == "notifications":
+                    notifications = element
+                elif name == "Notification":
+                    notification = dict.fromkeys(fields)
+                    notification["notificationId"] = None
+                elif name == "sObject" and notification is not None:
+                    in_sobject = True
+                continue
+
+            if in_sobject:
+                if name == "sObject":
+                    in_sobject = False
+                elif name in fields:
+                    notification[name] = element.text
+                element.clear()
+            elif notification is not None and name == "Id":
+                notification["notificationId"] = element.text
+            elif name == "Notification":
+                yield notification
+                notification = None
+                if notifications is not None:
+                    notifications.remove(element)
+    parser.close()
@@ -1,49 +1,18 @@
 import logging
-import os
 import azure.functions as func
 import requests
 import time
-import pyodbc
-
-db_url = os.environ["DB_URL"]
-db = os.environ["DB"]
-db_username = os.environ["DB_USERNAME"]
-db_password = os.environ["DB_PASSWORD"]
-db_driver = os.environ["DB_DRIVER"]
-jc_api_url = os.environ["JC_API_URL"]
-jc_api_username = os.environ["JC_API_USERNAME"]
-jc_api_login_path = os.environ["JC_API_LOGIN_PATH"]
-jc_api_unlist_path = os.environ["JC_API_UNLIST_PATH"]
-
-def getAccessToken():
-    retries = 1
-    while retries < 3:
-        r = requests.post(
-            f"https://{jc_api_url}/{jc_api_login_path}", json={"email": jc_api_username}
-        )
-        # logging.info(r)
-        if r.status_code == 200:
-            return r.json().get("accessToken")
-        else:
-            wait = retries * 3
-            time.sleep(wait)
-            retries += 1
 
-    return None
+from shared_code import database, jc
 
-def unlistOccurrence(accessToken, occurrenceId, cnxn, cursor):
-    retries = 1
-    head = {"Authorization": "Bearer " + accessToken}
 
-    json_body = [{
-        "vmpJobId": occurrenceId,
-        "visibility": "unlisted"
-    }]
+def unlistOccurrence(occurrenceId, cnxn, cursor):
+    retries = 1
 
     while retries < 3:
-        r = requests.post(
-            f"https://{jc_api_url}/{jc_api_unlist_path}", json=json_body, headers=head
-        )
+        r = jc.unlist([occurrenceId])
+        if r is None:
+            break
         if r.status_code == 200:
             dict = r.json()
             logging.info(dict)
@@ -51,10 +20,8 @@ def unlistOccurrence(accessToken, occurrenceId, cnxn, cursor):
             successes = dict.get("success")
 
             if successes.get("total") > 0:
-                ids = successes.get("ids")
-                sql_ids = (",").join(f"'{w}'" for w in ids)
-                cursor.execute(
-                    f"UPDATE occurrences SET send=0, status='UNLISTED', error='', updatedAt='{time.strftime('%Y-%m-%d %H:%M:%S')}' WHERE occurrenceId IN ({sql_ids})"
+                database.writeOccurrenceStatus(
+                    cursor, [(id, "UNLISTED", "") for id in successes.get("ids")]
                 )
                 cnxn.commit()
 
@@ -62,10 +29,10 @@ def unlistOccurrence(accessToken, occurrenceId, cnxn, cursor):
                 for d in errors.get("data"):
                     id = d.get("id")
                     message = d.get("message")
-                    #cursor.execute(
+                    # cursor.execute(
                     #    f"UPDATE occurrences SET send=0, status='ERRORED', error='{message}', updatedAt='{time.strftime('%Y-%m-%d %H:%M:%S')}' WHERE occurrenceId='{id}'"
-                    #)
-                    #cnxn.commit()
+                    # )
+                    # cnxn.commit()
 
             return (successes.get("total"), errors.get("total"))
         else:
@@ -82,34 +49,13 @@ def unlistOccurrence(accessToken, occurrenceId, cnxn, cursor):
             retries += 1
 
     logging.info("Failed to unlist")
-    return (0, len(list))
+    return (0, 1)
 
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("Call unlist function.")
 
-    # DB retry
-    cnxn = None
-    for i in range(0, 4):
-        while True:
-            try:
-                cnxn = pyodbc.connect(
-                    "DRIVER="
-                    + db_driver
-                    + ";SERVER="
-                    + db_url
-                    + ";PORT=1433;DATABASE="
-                    + db
-                    + ";UID="
-                    + db_username
-                    + ";PWD="
-                    + db_password
-                    + ";Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
-                )
-            except pyodbc.Error as ex:
-                time.sleep(2.0)
-                continue
-            break
+    cnxn = database.getConnection()
     if cnxn == None:
         logging.info("Could not connect to database")
         return func.HttpResponse("Could not obtain accessToken", status_code=400)
@@ -121,31 +67,30 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
         req_body = req.get_json()
     except ValueError:
-        return func.HttpResponse(
-            "Please pass a JSON body",
-            status_code=400
-        )
+        cursor.close()
+        database.releaseConnection(cnxn)
+        return func.HttpResponse("Please pass a JSON body", status_code=400)
 
     occurrenceId = req_body.get("occurrenceId")
     if not occurrenceId:
+        cursor.close()
+        database.releaseConnection(cnxn)
         return func.HttpResponse(
             "Please pass one occurrenceId in the body",
             status_code=400,
         )
 
-    accessToken = getAccessToken()
-    if accessToken is None:
+    if jc.getAccessToken() is None:
         logging.info("Could not obtain accessToken.")
         cursor.close()
-        cnxn.close()
+        database.releaseConnection(cnxn)
         return func.HttpResponse("Could not obtain accessToken", status_code=400)
-    successes, errors = unlistOccurrence(accessToken, occurrenceId, cnxn, cursor)
+    successes, errors = unlistOccurrence(occurrenceId, cnxn, cursor)
 
     end_time = time.time()
 
     return_message = f"Unlisted {occurrenceId}. Time: {str(end_time-start_time)}s"
     logging.info(return_message)
     cursor.close()
-    cnxn.close()
+    database.releaseConnection(cnxn)
     return func.HttpResponse(return_message, status_code=200)
-